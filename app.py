@@ -1,13 +1,33 @@
 import os
+import re
+import time
+import json
+import uuid
+import hashlib
+import threading
+import math
+import mmap
+import stat
+import struct
 import logging
 import tempfile
-import signal
+import functools
+import multiprocessing
+import numpy as np
 from flask import Flask, render_template, request, redirect, url_for, flash
 from werkzeug.utils import secure_filename
 from werkzeug.middleware.proxy_fix import ProxyFix
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import pyembroidery
 from pxf_analyzer import PXFAnalyzer
 
+try:
+    import xxhash  # opcjonalnie: szybszy hash kluczy cache
+except ImportError:
+    xxhash = None
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
@@ -19,41 +39,339 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1,
 
 # Configuration
 UPLOAD_FOLDER = tempfile.gettempdir()
-ALLOWED_EXTENSIONS = {'pxf', 'dst', 'pes', 'jef', 'exp', 'vp3', 'hus',
-                      'xxx'}  # Support more embroidery formats
+ALLOWED_EXTENSIONS = frozenset({'pxf', 'dst', 'pes', 'jef', 'exp', 'vp3', 'hus',
+                                'xxx'})  # Support more embroidery formats
 MAX_CONTENT_LENGTH = 128 * 1024 * 1024  # 128MB max file size dla bardzo dużych plików przemysłowych
 
+# Wersja oprogramowania w metadanych PXF (np. "DG16")
+_VERSION_RE = re.compile(rb'DG(\d+)')
+# Cztery wartości wymiarów w nagłówku PMLPXF (offset 8-23, little-endian)
+_HEADER_DIMS = struct.Struct('<4I')
+# Pojedyncze pola binarne PXF (little-endian)
+_UINT16 = struct.Struct('<H')
+_UINT32 = struct.Struct('<I')
+_FLOAT32 = struct.Struct('<f')
+# Sygnatury plików PXF obsługiwanych przez PXFAnalyzer
+PXF_SIGNATURES = (b'PMLPXF', b'PXF')
+# Heurystyki PXF analizują tylko początek pliku: współrzędne z pierwszego
+# 1 MiB (wynik jest skalowany do rozmiaru pliku), kolory z pierwszych 2 MiB
+PXF_COORD_SAMPLE_BYTES = 1024 * 1024
+PXF_COLOR_SCAN_BYTES = 2 * 1024 * 1024
+# Sonda wartości float w metodach alternatywnych: ograniczenie pracy (liczba
+# sprawdzanych offsetów) i wyniku (liczba zapisanych trafień). Prawie każdy
+# offset dekoduje się do liczby z zakresu, więc bez limitu trafień
+# raw_data_analysis miałby klucz na każdy bajt pliku.
+PXF_FLOAT_PROBE_OFFSETS = 1000000
+PXF_FLOAT_PROBE_MAX_HITS = 50
+
+# Cache wyników analizy (klucz: rozszerzenie + hash zawartości pliku z
+# new_content_hash - xxh3, jeśli zainstalowano xxhash, w przeciwnym razie BLAKE2b)
+ANALYSIS_CACHE_SIZE = 128
+ANALYSIS_CACHE_TTL = 600  # sekundy
+_analysis_cache = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+# Duże pliki analizowane są w tle. Stan zadania zapisywany jest jako JSON
+# w UPLOAD_FOLDER, więc odpytywanie działa z dowolnego workera gunicorna.
+BACKGROUND_ANALYSIS_MIN_SIZE = 4 * 1024 * 1024
+# Osobne procesy - analiza to głównie pętle Pythona trzymające GIL.
+# Pula tworzona jest przy pierwszym użyciu (i ponownie, gdy proces padnie).
+# Każdy worker gunicorna ma własną pulę, więc domyślnie jeden proces.
+ANALYSIS_WORKERS = max(1, int(os.environ.get('ANALYSIS_WORKERS', 1)))
+# Zadanie "pending" starsze niż limit uznawane jest za porzucone (np. worker
+# odnowiony przez max_requests) - z zapasem na kolejkę w puli
+BACKGROUND_JOB_TIMEOUT = 30 * 60  # sekundy
+_analysis_executor = None
+_analysis_executor_lock = threading.Lock()
+_JOB_ID_RE = re.compile(r'[0-9a-f]{32}')
+
+# Maksymalny czas analizy PXFAnalyzer dla bardzo złożonych plików
+PXF_ANALYSIS_TIMEOUT = 600  # sekundy
+
+# Wersja formatu wyników w dyskowym cache analizy PXF - zmień po każdej
+# zmianie try_pxf_analysis, aby unieważnić stare wpisy
+PXF_CACHE_VERSION = 5
+# Dyskowy cache PXF leży we współdzielonym katalogu tymczasowym - ogranicz
+# liczbę wpisów i ich wiek (wiek liczony od ostatniego użycia)
+PXF_DISK_CACHE_MAX_ENTRIES = 256
+PXF_DISK_CACHE_TTL = 7 * 24 * 3600  # sekundy
+
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
+# Skompiluj szablony przy imporcie, a nie przy pierwszym żądaniu
+for _template_name in ('index.html', 'results.html', 'pxf_error.html',
+                       'processing.html'):
+    app.jinja_env.get_template(_template_name)
+
 
 def allowed_file(filename):
     """Check if file has allowed extension"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    # rpartition nie buduje listy; splitext odrzucałby nazwy typu ".pxf"
+    _, dot, ext = filename.rpartition('.')
+    return bool(dot) and ext.lower() in ALLOWED_EXTENSIONS
 
 
-def timeout_handler(signum, frame):
-    """Handle timeout signal for long-running analysis"""
-    raise TimeoutError("Analysis timed out - plik może być zbyt duży lub złożony")
+def new_content_hash():
+    """Return an incremental hasher for cache keys (xxh3 if available)"""
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
 
 
-def try_pxf_analysis(file_path):
-    """Try to extract detailed information from PXF files using advanced binary analysis"""
+def get_cached_analysis(key):
+    """Return cached (analysis, error) for a content key, or None"""
+    with _analysis_cache_lock:
+        entry = _analysis_cache.get(key)
+        if entry is None:
+            return None
+        stored_at, result = entry
+        if time.monotonic() - stored_at > ANALYSIS_CACHE_TTL:
+            del _analysis_cache[key]
+            return None
+        _analysis_cache.move_to_end(key)
+        return result
+
+
+def store_cached_analysis(key, result):
+    """Store a successful (analysis, None) result, evicting the oldest entries"""
+    # Błędy (timeout, padnięty proces puli) mogą być przejściowe - nie
+    # serwuj ich z cache przez cały TTL
+    analysis, error = result
+    if analysis is None or error is not None:
+        return
+    with _analysis_cache_lock:
+        _analysis_cache[key] = (time.monotonic(), result)
+        _analysis_cache.move_to_end(key)
+        while len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+
+
+def job_result_path(job_id):
+    """Path of the JSON file holding a background analysis job state"""
+    return os.path.join(app.config['UPLOAD_FOLDER'],
+                        f'embroidery-job-{job_id}.json')
+
+
+def write_json_atomic(path, obj):
+    """Write obj as JSON to path via a temporary file and rename"""
+    fd, part_path = tempfile.mkstemp(suffix='.part',
+                                     dir=os.path.dirname(path))
     try:
-        with open(file_path, 'rb') as f:
-            data = f.read()
+        with os.fdopen(fd, 'w', encoding='utf-8') as part_file:
+            json.dump(obj, part_file)
+        os.replace(part_path, path)
+    except BaseException:
+        os.remove(part_path)
+        raise
+
+
+def write_job_state(job_id, state):
+    """Atomically write a background analysis job state"""
+    write_json_atomic(job_result_path(job_id), state)
+
+
+def remove_job_files(job_id, temp_path=None):
+    """Remove a background job state and its uploaded file (if still present)"""
+    for path in (job_result_path(job_id), temp_path):
+        if path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logging.warning(f"Could not remove job file: {path}")
+
+
+def pxf_cache_dir():
+    """Private (0700) directory of the PXF disk cache, or None if it is unsafe"""
+    # Katalog tymczasowy jest współdzielony i zapisywalny dla wszystkich -
+    # wpisy cache muszą leżeć w katalogu należącym tylko do aplikacji
+    path = os.path.join(app.config['UPLOAD_FOLDER'],
+                        f'embroidery-pxf-cache-{os.getuid()}')
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        logging.warning(f"Could not create PXF cache directory: {e}")
+        return None
+
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid()
+            or st.st_mode & 0o077):
+        logging.warning(
+            f"PXF cache directory is not private, cache disabled: {path}")
+        return None
+    return path
+
+
+def pxf_cache_path(content_key):
+    """Path of the on-disk cache entry for a PXF analysis (None if no safe directory)"""
+    cache_dir = pxf_cache_dir()
+    if cache_dir is None:
+        return None
+    return os.path.join(cache_dir, f'.pxfcache_{content_key}.json')
+
+
+def load_pxf_cache(content_key):
+    """Return a cached PXF analysis from disk, or None"""
+    path = pxf_cache_path(content_key)
+    if path is None:
+        return None
+    try:
+        with open(path, encoding='utf-8') as cache_file:
+            if (time.time() - os.fstat(cache_file.fileno()).st_mtime >
+                    PXF_DISK_CACHE_TTL):
+                return None
+            entry = json.load(cache_file)
+        # Odśwież czas modyfikacji - przycinanie usuwa najdawniej używane
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    if entry.get('version') != PXF_CACHE_VERSION:
+        return None
+    return entry['analysis']
 
-        # Ustaw timeout na 600 sekund dla bardzo złożonych plików
-        signal.signal(signal.SIGALRM, timeout_handler)
-        signal.alarm(600)  # 10 minut timeout dla maksymalnej dokładności
 
+def store_pxf_cache(content_key, analysis):
+    """Store a PXF analysis on disk (failures are only logged)"""
+    path = pxf_cache_path(content_key)
+    if path is None:
+        return
+    try:
+        write_json_atomic(path, {
+            'version': PXF_CACHE_VERSION,
+            'analysis': analysis
+        })
+    except (OSError, TypeError, ValueError) as e:
+        logging.warning(f"Could not cache PXF analysis: {e}")
+    prune_pxf_cache()
+
+
+def prune_pxf_cache():
+    """Remove expired PXF cache entries, keeping the newest MAX_ENTRIES ones"""
+    cache_dir = pxf_cache_dir()
+    if cache_dir is None:
+        return
+    entries = []
+    try:
+        with os.scandir(cache_dir) as folder:
+            for entry in folder:
+                if (entry.name.startswith('.pxfcache_')
+                        and entry.name.endswith('.json')):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except OSError:
+                        pass  # usunięty równolegle przez inny worker
+    except OSError as e:
+        logging.warning(f"Could not prune PXF cache: {e}")
+        return
+
+    now = time.time()
+    entries.sort(reverse=True)
+    for index, (mtime, path) in enumerate(entries):
+        if (index >= PXF_DISK_CACHE_MAX_ENTRIES
+                or now - mtime > PXF_DISK_CACHE_TTL):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def submit_background_analysis(*args):
+    """Submit run_background_analysis to the process pool"""
+    global _analysis_executor
+    with _analysis_executor_lock:
+        for attempt in range(2):
+            if _analysis_executor is None:
+                _analysis_executor = ProcessPoolExecutor(
+                    max_workers=ANALYSIS_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'))
+            try:
+                return _analysis_executor.submit(run_background_analysis,
+                                                 *args)
+            except BrokenProcessPool:
+                if attempt:
+                    raise
+                logging.warning("Analysis process pool broken, restarting")
+                _analysis_executor = None
+
+
+def run_background_analysis(job_id, temp_path, filename, content_key=None):
+    """Analyze an uploaded file in a worker process and store the result"""
+    try:
+        result = analyze_embroidery_file(temp_path, content_key=content_key)
+    except Exception as e:
+        logging.error(f"Background analysis error: {str(e)}")
+        result = (None, str(e))
+    finally:
         try:
-            # Użyj zaawansowanego analizatora PXF
-            pxf_analyzer = PXFAnalyzer(data)
-            advanced_analysis = pxf_analyzer.analyze()
-        finally:
-            signal.alarm(0)  # Anuluj timeout
+            os.remove(temp_path)
+        except OSError:
+            logging.warning(f"Could not remove temporary file: {temp_path}")
+
+    analysis, error = result
+    write_job_state(job_id, {
+        'status': 'done',
+        'filename': filename,
+        'analysis': analysis,
+        'error': error
+    })
+    return result
+
+
+def finish_background_analysis(job_id, filename, cache_key, future):
+    """Cache a finished background analysis (or record a crashed worker)"""
+    try:
+        store_cached_analysis(cache_key, future.result())
+    except Exception as e:
+        logging.error(f"Background analysis failed: {str(e)}")
+        write_job_state(job_id, {
+            'status': 'done',
+            'filename': filename,
+            'analysis': None,
+            'error': str(e)
+        })
+
+
+def try_pxf_analysis(file_path, content_key=None):
+    """Try to extract detailed information from PXF files using advanced binary analysis"""
+    data = b''
+    try:
+        # Mapuj plik zamiast kopiować całą zawartość do pamięci. Mapa jest
+        # zamykana jawnie w finally - widoki NumPy żyją tylko w funkcjach
+        # pomocniczych, a wynik nie trzyma referencji do danych.
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = b''
+
+        # Wynik dla tej samej zawartości może już być w cache na dysku.
+        # Hash (new_content_hash) zwykle policzył już upload_file.
+        if content_key is None:
+            content_hash = new_content_hash()
+            content_hash.update(data)
+            content_key = content_hash.hexdigest()
+        cached = load_pxf_cache(content_key)
+        if cached is not None:
+            cached['filename'] = os.path.basename(file_path)
+            return cached
+
+        # Tekst pliku dekoduj raz i współdziel między analizatorami
+        text_content = str(data, 'utf-8', errors='ignore')
+
+        # Limit czasu sprawdza sam PXFAnalyzer w długich pętlach, więc działa
+        # w każdym wątku. SIGALRM działał tylko w głównym wątku, a timeout
+        # gunicorna (gthread) to heartbeat workera, nie limit żądania.
+        pxf_analyzer = PXFAnalyzer(
+            data, text_content,
+            deadline=time.monotonic() + PXF_ANALYSIS_TIMEOUT)
+        advanced_analysis = pxf_analyzer.analyze()
 
         # Konwertuj wyniki do formatu kompatybilnego z resztą aplikacji
         analysis = {
@@ -216,28 +534,28 @@ def try_pxf_analysis(file_path):
         detailed_info = {}
 
         # Check for PMLPXF header and extract detailed information
-        if data.startswith(b'PMLPXF01'):
+        if data[:8] == b'PMLPXF01':
             header_info.append('PMLPXF Version 1 format detected')
 
             try:
-                # Extract file header information (first 64 bytes contain important data)
-                header = data[:64]
+                # Wymiary i kolory odczytane już przez PXFAnalyzer nie są
+                # wyznaczane drugi raz
+                header_dims = advanced_analysis['header_analysis'].get(
+                    'dimensions')
+                if header_dims:
+                    detailed_info['design_size'] = (
+                        f"{header_dims['width'] / 10.0:.1f} × "
+                        f"{header_dims['height'] / 10.0:.1f} cm")
 
                 # Try to extract design dimensions from header
                 # PMLPXF stores dimensions in specific byte positions
-                if len(header) >= 32:
+                # (first 64 bytes contain important data)
+                elif len(data) >= 32:
                     # Extract potential width/height values (little-endian format)
-                    import struct
                     try:
-                        # Common positions for dimension data in PMLPXF
-                        val1 = struct.unpack('<I',
-                                             header[8:12])[0]  # Position 8-11
-                        val2 = struct.unpack(
-                            '<I', header[12:16])[0]  # Position 12-15
-                        val3 = struct.unpack(
-                            '<I', header[16:20])[0]  # Position 16-19
-                        val4 = struct.unpack(
-                            '<I', header[20:24])[0]  # Position 20-23
+                        # Common positions for dimension data in PMLPXF (8-23)
+                        val1, val2, val3, val4 = _HEADER_DIMS.unpack_from(
+                            data, 8)
 
                         # Filter reasonable dimension values (in 0.1mm units)
                         reasonable_dims = [
@@ -260,22 +578,18 @@ def try_pxf_analysis(file_path):
                     # Extract metadata around "Created" marker
                     start = max(0, created_pos - 30)
                     end = min(len(data), created_pos + 150)
-                    metadata = data[start:end]
                     try:
-                        metadata_str = metadata.decode('utf-8',
-                                                       errors='ignore')
                         # Extract software information
-                        if 'Tajima' in metadata_str:
+                        if data.find(b'Tajima', start, end) != -1:
                             detailed_info['software'] = 'Tajima DG/ML by Pulse'
-                        elif 'Pulse' in metadata_str:
+                        elif data.find(b'Pulse', start, end) != -1:
                             detailed_info['software'] = 'Pulse Software'
 
                         # Extract version if present
-                        import re
-                        version_match = re.search(r'DG(\d+)', metadata_str)
+                        version_match = _VERSION_RE.search(data, start, end)
                         if version_match:
                             detailed_info[
-                                'software_version'] = f"DG{version_match.group(1)}"
+                                'software_version'] = f"DG{version_match.group(1).decode()}"
 
                         header_info.append(
                             f'Software: {detailed_info.get("software", "Unknown")}'
@@ -284,32 +598,12 @@ def try_pxf_analysis(file_path):
                     except:
                         pass
 
-                # Analyze pattern complexity by looking for stitch patterns
-                stitch_patterns = 0
-                jump_patterns = 0
-
-                # Look for common stitch command patterns in PXF files
-                for i in range(0, len(data) - 4, 4):
-                    try:
-                        # PXF stores coordinates and commands in 4-byte chunks
-                        chunk = data[i:i + 4]
-                        if len(chunk) == 4:
-                            # Look for coordinate patterns (reasonable X,Y values)
-                            x = struct.unpack(
-                                '<h', chunk[:2])[0] if len(chunk) >= 2 else 0
-                            y = struct.unpack(
-                                '<h', chunk[2:])[0] if len(chunk) >= 2 else 0
-
-                            # Count potential stitch coordinates
-                            if -5000 < x < 5000 and -5000 < y < 5000:
-                                stitch_patterns += 1
-
-                            # Look for jump patterns (larger coordinate changes)
-                            if abs(x) > 1000 or abs(y) > 1000:
-                                jump_patterns += 1
-
-                    except (struct.error, IndexError):
-                        continue
+                # Analyze pattern complexity (stitch/jump patterns) and
+                # collect color candidates from one view of the data
+                buffer_scan = scan_pxf_buffer(
+                    data, find_colors=not analysis['colors'])
+                stitch_patterns = buffer_scan['stitch_patterns']
+                jump_patterns = buffer_scan['jump_patterns']
 
                 # Estimate stitch count based on pattern analysis
                 if stitch_patterns > 0:
@@ -347,28 +641,14 @@ def try_pxf_analysis(file_path):
 
                 # Advanced color analysis - look for RGB patterns
                 colors_found = []
-                pos = 0
-                while pos < len(data) - 6 and len(colors_found) < 20:
-                    # Look for RGB color patterns (3 consecutive bytes with reasonable values)
-                    if (pos + 2 < len(data) and data[pos] <= 255
-                            and data[pos + 1] <= 255 and data[pos + 2] <= 255):
-
-                        r, g, b = data[pos], data[pos + 1], data[pos + 2]
-                        # Skip very dark colors (likely not thread colors)
-                        if r + g + b > 50:
-                            hex_color = f"#{r:02X}{g:02X}{b:02X}"
-                            if hex_color not in [
-                                    c['hex'] for c in colors_found
-                            ]:
-                                color_name = get_color_name(r, g, b)
-                                colors_found.append({
-                                    'hex': hex_color,
-                                    'name': color_name,
-                                    'rgb': f"RGB({r},{g},{b})"
-                                })
-                        pos += 3
-                    else:
-                        pos += 1
+                rgb_triples = buffer_scan['rgb_triples']
+                color_names = get_color_names(rgb_triples)
+                for (r, g, b), color_name in zip(rgb_triples, color_names):
+                    colors_found.append({
+                        'hex': f"#{r:02X}{g:02X}{b:02X}",
+                        'name': color_name,
+                        'rgb': f"RGB({r},{g},{b})"
+                    })
 
                 # Update thread count and colors
                 if colors_found:
@@ -397,7 +677,8 @@ def try_pxf_analysis(file_path):
                             'thread_consumption'] = f"{estimated_length:.0f} cm"
 
                 # Extract embroidery parameters from PXF file
-                embroidery_params = extract_pxf_embroidery_parameters(data)
+                embroidery_params = extract_pxf_embroidery_parameters(
+                    data, text_content)
                 analysis['embroidery_parameters'] = embroidery_params
 
                 # Extract stitch techniques
@@ -421,18 +702,60 @@ def try_pxf_analysis(file_path):
         analysis[
             'conversion_note'] = 'Ten plik wymaga konwersji do formatu .dst, .pes lub .jef aby uzyskać pełne informacje o wzorze haftu.'
 
+        if advanced_analysis['analysis_success']:
+            store_pxf_cache(content_key, analysis)
+
         return analysis
 
     except TimeoutError as e:
+        # Przekaż dalej - analyze_embroidery_file zwróci błąd, który nie
+        # trafia do cache (zamiast mylącego "nieobsługiwany wariant")
         logging.error(f"Analysis timeout: {e}")
-        return None
+        raise
     except Exception as e:
         logging.error(f"Error in PXF binary analysis: {e}")
         return None
-
-
-def analyze_pxf_with_alternative_methods(data):
+    finally:
+        if isinstance(data, mmap.mmap):
+            try:
+                data.close()
+            except BufferError:
+                # Widok z ramki przerwanej wyjątkiem - mapę zwolni GC
+                logging.warning(f"PXF mapping still in use: {file_path}")
+
+
+# Parametry haftu zapisane jako XML (<density>...</density>)
+_XML_PARAM_RES = {
+    param: re.compile(pattern, re.IGNORECASE)
+    for param, pattern in {
+        'density': r'<density[^>]*>([^<]+)</density>',
+        'underlay': r'<underlay[^>]*>([^<]+)</underlay>',
+        'compensation': r'<compensation[^>]*>([^<]+)</compensation>',
+        'angle': r'<angle[^>]*>([^<]+)</angle>',
+        'fill': r'<fill[^>]*>([^<]+)</fill>',
+        'stitch_type': r'<stitch_type[^>]*>([^<]+)</stitch_type>'
+    }.items()
+}
+# Parametry haftu zapisane jako klucz=wartość
+_KV_PARAM_RES = {
+    param: re.compile(pattern, re.IGNORECASE)
+    for param, pattern in {
+        'density': r'density\s*=\s*([^\s\n\r]+)',
+        'underlay': r'underlay\s*=\s*([^\s\n\r]+)',
+        'compensation': r'compensation\s*=\s*([^\s\n\r]+)',
+        'pull_comp': r'pull_compensation\s*=\s*([^\s\n\r]+)',
+        'angle': r'angle\s*=\s*([^\s\n\r]+)',
+        'fill_type': r'fill_type\s*=\s*([^\s\n\r]+)',
+        'stitch_length': r'stitch_length\s*=\s*([^\s\n\r]+)'
+    }.items()
+}
+
+
+def analyze_pxf_with_alternative_methods(data, text_content=None):
     """Try alternative methods for extracting PXF embroidery data"""
+    if text_content is None:
+        text_content = str(data, 'utf-8', errors='ignore')
+
     results = {
         'method_used': [],
         'parameters_found': {},
@@ -441,81 +764,76 @@ def analyze_pxf_with_alternative_methods(data):
 
     try:
         # Method 1: File structure analysis
-        if data.startswith(b'PMLPXF'):
+        if data[:6] == b'PMLPXF':
             results['method_used'].append('PMLPXF header analysis')
             # Analyze file structure
-            header_size = struct.unpack('<I',
-                                        data[8:12])[0] if len(data) > 12 else 0
+            header_size = _UINT32.unpack_from(
+                data, 8)[0] if len(data) > 12 else 0
             if header_size > 0 and header_size < len(data):
                 results['parameters_found'][
                     'header_size'] = f"{header_size} bytes"
 
         # Method 2: XML-like content search
-        if b'<' in data and b'>' in data:
+        if data.find(b'<') != -1 and data.find(b'>') != -1:
             results['method_used'].append('XML/structured content search')
             # Look for XML-like parameters
-            import re
-            xml_content = data.decode('utf-8', errors='ignore')
-
             # Search for common embroidery parameters in XML format
-            xml_patterns = {
-                'density': r'<density[^>]*>([^<]+)</density>',
-                'underlay': r'<underlay[^>]*>([^<]+)</underlay>',
-                'compensation': r'<compensation[^>]*>([^<]+)</compensation>',
-                'angle': r'<angle[^>]*>([^<]+)</angle>',
-                'fill': r'<fill[^>]*>([^<]+)</fill>',
-                'stitch_type': r'<stitch_type[^>]*>([^<]+)</stitch_type>'
-            }
-
-            for param, pattern in xml_patterns.items():
-                match = re.search(pattern, xml_content, re.IGNORECASE)
+            for param, pattern in _XML_PARAM_RES.items():
+                match = pattern.search(text_content)
                 if match:
                     results['parameters_found'][param] = match.group(1).strip()
 
         # Method 3: Key-value pair search
-        if b'=' in data:
+        if data.find(b'=') != -1:
             results['method_used'].append('Key-value pair analysis')
-            text_content = data.decode('utf-8', errors='ignore')
 
             # Search for key=value patterns
-            kv_patterns = {
-                'density': r'density\s*=\s*([^\s\n\r]+)',
-                'underlay': r'underlay\s*=\s*([^\s\n\r]+)',
-                'compensation': r'compensation\s*=\s*([^\s\n\r]+)',
-                'pull_comp': r'pull_compensation\s*=\s*([^\s\n\r]+)',
-                'angle': r'angle\s*=\s*([^\s\n\r]+)',
-                'fill_type': r'fill_type\s*=\s*([^\s\n\r]+)',
-                'stitch_length': r'stitch_length\s*=\s*([^\s\n\r]+)'
-            }
-
-            for param, pattern in kv_patterns.items():
-                match = re.search(pattern, text_content, re.IGNORECASE)
+            for param, pattern in _KV_PARAM_RES.items():
+                match = pattern.search(text_content)
                 if match:
                     results['parameters_found'][param] = match.group(1).strip()
 
         # Method 4: Binary pattern analysis
         results['method_used'].append('Binary pattern recognition')
 
-        # Look for common binary patterns that might indicate parameters
-        for i in range(0, len(data) - 8, 1):
-            # Check for 4-byte float values that might be parameters
-            try:
-                if i + 4 < len(data):
-                    float_val = struct.unpack('<f', data[i:i + 4])[0]
-                    # Check if this could be a density value (0.1 to 10 mm)
-                    if 0.1 <= float_val <= 10.0:
-                        results['raw_data_analysis'][
-                            f'potential_density_{i}'] = f"{float_val:.2f}"
-                    # Check if this could be an angle (-180 to 180 degrees)
-                    elif -180 <= float_val <= 180:
-                        results['raw_data_analysis'][
-                            f'potential_angle_{i}'] = f"{float_val:.1f}°"
-                    # Check if this could be a percentage (0 to 100)
-                    elif 0 <= float_val <= 100:
-                        results['raw_data_analysis'][
-                            f'potential_percentage_{i}'] = f"{float_val:.1f}%"
-            except:
-                continue
+        # Look for common binary patterns that might indicate parameters:
+        # 4-byte float values at every byte offset, one view per alignment.
+        # Bloki po 64 KiB - skan kończy się po zebraniu limitu trafień
+        raw_analysis = results['raw_data_analysis']
+        probe_count = min(max(0, len(data) - 8), PXF_FLOAT_PROBE_OFFSETS)
+        for start in range(0, probe_count, 64 * 1024):
+            stop = min(start + 64 * 1024, probe_count)
+            floats = np.empty(stop - start, dtype=np.float32)
+            for align in range(min(4, stop - start)):
+                floats[align::4] = np.frombuffer(
+                    data,
+                    dtype='<f4',
+                    count=len(range(start + align, stop, 4)),
+                    offset=start + align)
+
+            # Density (0.1 to 10 mm), angle (-180 to 180 degrees), percentage (0 to 100)
+            density_mask = (floats >= 0.1) & (floats <= 10.0)
+            angle_mask = ~density_mask & (floats >= -180) & (floats <= 180)
+            percentage_mask = (~density_mask & ~angle_mask & (floats >= 0) &
+                               (floats <= 100))
+
+            # Tylko pierwsze trafienia w kolejności offsetów
+            hits = np.flatnonzero(
+                density_mask | angle_mask |
+                percentage_mask)[:PXF_FLOAT_PROBE_MAX_HITS - len(raw_analysis)]
+            for i, float_val, is_density, is_angle in zip(
+                    (hits + start).tolist(), floats[hits].tolist(),
+                    density_mask[hits].tolist(), angle_mask[hits].tolist()):
+                if is_density:
+                    raw_analysis[f'potential_density_{i}'] = f"{float_val:.2f}"
+                elif is_angle:
+                    raw_analysis[f'potential_angle_{i}'] = f"{float_val:.1f}°"
+                else:
+                    raw_analysis[
+                        f'potential_percentage_{i}'] = f"{float_val:.1f}%"
+
+            if len(raw_analysis) >= PXF_FLOAT_PROBE_MAX_HITS:
+                break
 
         # Method 5: String pattern analysis
         results['method_used'].append('String pattern analysis')
@@ -533,7 +851,7 @@ def analyze_pxf_with_alternative_methods(data):
             'outline': 'Outline settings detected'
         }
 
-        text_lower = data.decode('utf-8', errors='ignore').lower()
+        text_lower = text_content.lower()
         for term, description in embroidery_terms.items():
             if term in text_lower:
                 results['parameters_found'][term] = description
@@ -541,31 +859,39 @@ def analyze_pxf_with_alternative_methods(data):
         # Method 6: Coordinate analysis for stitch patterns
         results['method_used'].append('Coordinate pattern analysis')
 
-        coordinates = []
-        for i in range(0, len(data) - 4, 2):
-            try:
-                x = struct.unpack('<h', data[i:i + 2])[0]
-                y = struct.unpack('<h', data[i + 2:i + 4])[0]
-                if -32000 < x < 32000 and -32000 < y < 32000:
-                    coordinates.append((x, y))
-            except:
-                continue
-
-        if len(coordinates) > 10:
-            # Analyze stitch patterns
-            distances = []
-            for i in range(1, min(len(coordinates), 100)):
-                x1, y1 = coordinates[i - 1]
-                x2, y2 = coordinates[i]
-                dist = ((x2 - x1)**2 + (y2 - y1)**2)**0.5
-                distances.append(dist)
-
-            if distances:
-                avg_distance = sum(distances) / len(distances)
+        # Int16 (X, Y) pairs at every even offset, filtered in one pass
+        # Porównania na widoku int16 bez kopii; poszerzane są tylko wybrane
+        # punkty (różnice int16 mogłyby się przepełnić)
+        pair_count = max(0, (len(data) - 3) // 2)
+        if pair_count:
+            words = np.frombuffer(data, dtype='<i2', count=pair_count + 1)
+        else:
+            words = np.zeros(1, dtype=np.int16)
+        xs, ys = words[:-1], words[1:]
+        valid = xs > -32000
+        valid &= xs < 32000
+        valid &= ys > -32000
+        valid &= ys < 32000
+        coordinate_count = int(np.count_nonzero(valid))
+
+        if coordinate_count > 10:
+            # Analyze stitch patterns (first 100 coordinates) - indeksy
+            # tylko z początkowych bloków maski, nie z całego pliku
+            first = []
+            for start in range(0, len(valid), 64 * 1024):
+                block = np.flatnonzero(valid[start:start + 64 * 1024])
+                first.extend((block[:100 - len(first)] + start).tolist())
+                if len(first) >= 100:
+                    break
+            distances = np.hypot(np.diff(xs[first].astype(np.int32)),
+                                 np.diff(ys[first].astype(np.int32)))
+
+            if distances.size:
+                avg_distance = float(distances.mean())
                 results['parameters_found'][
                     'avg_stitch_length'] = f"{avg_distance/100:.2f} cm"
                 results['parameters_found'][
-                    'stitch_pattern_detected'] = f"{len(coordinates)} coordinate pairs"
+                    'stitch_pattern_detected'] = f"{coordinate_count} coordinate pairs"
 
     except Exception as e:
         results['method_used'].append(f'Error in analysis: {str(e)}')
@@ -573,7 +899,33 @@ def analyze_pxf_with_alternative_methods(data):
     return results
 
 
-def extract_pxf_embroidery_parameters(data):
+def find_marker_windows(data, marker_re, window, last_start):
+    """Sorted start offsets (0..last_start) of windows containing a marker_re match"""
+    # search() od pos + 1 zamiast finditer - znajduje też znaczniki
+    # nachodzące na poprzednie trafienie (np. "spac" w "denspac")
+    starts = set()
+    match = marker_re.search(data)
+    while match:
+        pos = match.start()
+        starts.update(
+            range(max(0, match.end() - window), min(pos, last_start) + 1))
+        match = marker_re.search(data, pos + 1)
+    return sorted(starts)
+
+
+# Znaczniki okien gęstości i rozstawu rzędów w danych binarnych (dowolna
+# wielkość liter) - wartością jest float w pobliżu znacznika
+_DENSITY_MARKER_RE = re.compile(rb'dens|spac', re.IGNORECASE)
+# Zapis gęstości / rozstawu rzędów w treści tekstowej
+_DENSITY_RES = [
+    re.compile(pattern, re.IGNORECASE) for pattern in (
+        r'density[:\s]*(\d+\.?\d*)', r'DENSITY[:\s]*(\d+\.?\d*)',
+        r'stitch_density[:\s]*(\d+\.?\d*)',
+        r'line_spacing[:\s]*(\d+\.?\d*)', r'spacing[:\s]*(\d+\.?\d*)')
+]
+
+
+def extract_pxf_embroidery_parameters(data, text_content=None):
     """Extract embroidery parameters from PXF file using multiple analysis methods"""
     params = {
         'row_spacing': 'Nieznane',
@@ -588,30 +940,22 @@ def extract_pxf_embroidery_parameters(data):
         'analysis_method': 'Analiza wielometodowa'
     }
 
+    # Method 1: Look for text-based parameters in PXF files
+    if text_content is None:
+        text_content = str(data, 'utf-8', errors='ignore')
+
     # Try alternative analysis methods
-    alternative_results = analyze_pxf_with_alternative_methods(data)
+    alternative_results = analyze_pxf_with_alternative_methods(
+        data, text_content)
     params['alternative_analysis'] = alternative_results
 
     try:
-        # Method 1: Look for text-based parameters in PXF files
-        text_content = data.decode('utf-8', errors='ignore')
-
-        # Method 2: Hex analysis for structured data
-        hex_data = data.hex()
-
         # Method 3: Try multiple density extraction methods
         density_found = False
 
         # Look for density in text content
-        import re
-        density_patterns = [
-            r'density[:\s]*(\d+\.?\d*)', r'DENSITY[:\s]*(\d+\.?\d*)',
-            r'stitch_density[:\s]*(\d+\.?\d*)',
-            r'line_spacing[:\s]*(\d+\.?\d*)', r'spacing[:\s]*(\d+\.?\d*)'
-        ]
-
-        for pattern in density_patterns:
-            match = re.search(pattern, text_content, re.IGNORECASE)
+        for pattern in _DENSITY_RES:
+            match = pattern.search(text_content)
             if match:
                 density_val = float(match.group(1))
                 if 0.1 <= density_val <= 50:  # Reasonable density range in mm
@@ -620,19 +964,21 @@ def extract_pxf_embroidery_parameters(data):
                     density_found = True
                     break
 
-        # Look for density settings in PXF files using binary search
+        # Look for density settings in PXF files using binary search.
+        # Only 16-byte windows containing "dens"/"spac" (any case) can match
         if not density_found:
-            for i in range(0, len(data) - 16):
+            density_windows = find_marker_windows(data, _DENSITY_MARKER_RE,
+                                                  16, len(data) - 17)
+            for i in density_windows:
                 chunk = data[i:i + 16]
+                lowered = chunk.lower()
 
                 # Look for density markers (common in Tajima PXF files)
                 if b'DENSITY' in chunk or b'density' in chunk:
                     try:
                         # Try to extract density value from surrounding bytes
-                        density_bytes = data[i + 8:i + 12]
-                        if len(density_bytes) == 4:
-                            import struct
-                            density_val = struct.unpack('<I', density_bytes)[0]
+                        if i + 12 <= len(data):
+                            density_val = _UINT32.unpack_from(data, i + 8)[0]
                             if 10 <= density_val <= 1000:  # Reasonable density range
                                 density_cm = (density_val /
                                               100) / 10.0  # Konwersja na cm
@@ -642,15 +988,16 @@ def extract_pxf_embroidery_parameters(data):
                     except:
                         pass
 
-                # Alternative: look for float values near density markers
-                if not density_found and (b'dens' in chunk.lower()
-                                          or b'spac' in chunk.lower()):
+                # Alternative: look for float values near density and
+                # row spacing markers (okna "spac" parsowane są tylko tutaj)
+                if not density_found and (b'dens' in lowered
+                                          or b'spac' in lowered):
                     try:
                         # Try to find float values in nearby bytes
                         for offset in range(-20, 21, 4):
                             if i + offset >= 0 and i + offset + 4 < len(data):
-                                test_bytes = data[i + offset:i + offset + 4]
-                                float_val = struct.unpack('<f', test_bytes)[0]
+                                float_val = _FLOAT32.unpack_from(
+                                    data, i + offset)[0]
                                 if 0.1 <= float_val <= 20:  # Reasonable density range
                                     density_cm = float_val / 10.0  # Konwersja na cm
                                     params[
@@ -662,6 +1009,10 @@ def extract_pxf_embroidery_parameters(data):
 
                 if density_found:
                     break
+            else:
+                # Dalsze sprawdzenia dotyczą ostatniego okna skanu
+                i = len(data) - 17
+                chunk = data[i:i + 16] if i >= 0 else b''
 
             # Look for underlay settings
             if b'UNDERLAY' in chunk or b'underlay' in chunk:
@@ -679,9 +1030,8 @@ def extract_pxf_embroidery_parameters(data):
             # Look for pull compensation settings
             if b'PULL' in chunk or b'pull' in chunk:
                 try:
-                    comp_bytes = data[i + 4:i + 8]
-                    if len(comp_bytes) >= 2:
-                        comp_val = struct.unpack('<H', comp_bytes[:2])[0]
+                    if i + 6 <= len(data):
+                        comp_val = _UINT16.unpack_from(data, i + 4)[0]
                         if 0 <= comp_val <= 100:
                             params['pull_compensation'] = f"{comp_val/10:.1f}%"
                 except:
@@ -699,28 +1049,25 @@ def extract_pxf_embroidery_parameters(data):
                 elif 'TATAMI' in fill_info:
                     params['fill_type'] = 'Tatami'
 
-        # Extract angle information from stitch patterns
-        angle_found = False
-        for i in range(0, len(data) - 8, 4):
-            try:
-                # Look for angle patterns in coordinate data
-                if i + 8 < len(data):
-                    x1 = struct.unpack('<h', data[i:i + 2])[0]
-                    y1 = struct.unpack('<h', data[i + 2:i + 4])[0]
-                    x2 = struct.unpack('<h', data[i + 4:i + 6])[0]
-                    y2 = struct.unpack('<h', data[i + 6:i + 8])[0]
-
-                    if all(abs(val) < 10000 for val in [x1, y1, x2, y2]):
-                        # Calculate angle if we have valid coordinates
-                        import math
-                        if x2 != x1 and not angle_found:
-                            angle = math.degrees(math.atan2(y2 - y1, x2 - x1))
-                            if -180 <= angle <= 180:
-                                params['fill_angle'] = f"{angle:.0f}°"
-                                angle_found = True
-                                break
-            except:
-                continue
+        # Extract angle information from stitch patterns: the first two
+        # consecutive int16 (X, Y) points within range and with distinct X
+        pair_count = len(range(0, len(data) - 8, 4))
+        for start in range(0, pair_count, 64 * 1024):
+            stop = min(start + 64 * 1024, pair_count)
+            points = np.frombuffer(data,
+                                   dtype='<i2',
+                                   count=(stop - start + 1) * 2,
+                                   offset=start * 4).reshape(-1, 2).astype(
+                                       np.int32)
+            in_range = (np.abs(points) < 10000).all(axis=1)
+            candidates = (in_range[:-1] & in_range[1:] &
+                          (points[1:, 0] != points[:-1, 0]))
+            if candidates.any():
+                k = int(candidates.argmax())
+                dx, dy = (points[k + 1] - points[k]).tolist()
+                angle = math.degrees(math.atan2(dy, dx))
+                params['fill_angle'] = f"{angle:.0f}°"
+                break
 
     except Exception as e:
         logging.warning(f"Error extracting embroidery parameters: {e}")
@@ -728,6 +1075,33 @@ def extract_pxf_embroidery_parameters(data):
     return params
 
 
+# Markery technik haftu zapisane tekstowo w pliku PXF
+_TECHNIQUE_MARKERS = {
+    b'SATIN': 'Satin Stitch',
+    b'ZIGZAG': 'Zigzag Fill',
+    b'TATAMI': 'Tatami Fill',
+    b'CROSS': 'Cross Hatch',
+    b'OUTLINE': 'Outline Stitch',
+    b'BEAN': 'Bean Stitch',
+    b'STEM': 'Stem Stitch',
+    b'CHAIN': 'Chain Stitch',
+    b'BLANKET': 'Blanket Stitch',
+    b'APPLIQUE': 'Applique',
+    b'MOTIF': 'Motif Fill',
+    b'RADIAL': 'Radial Fill',
+    b'SPIRAL': 'Spiral Fill',
+    b'CONTOUR': 'Contour Fill'
+}
+# Grupa wyników dla każdego markera, ustalona raz przy imporcie
+_TECHNIQUE_GROUPS = {
+    marker: ('fill_techniques' if b'FILL' in marker or b'TATAMI' in marker
+             else 'outline_techniques'
+             if b'OUTLINE' in marker or b'STEM' in marker else
+             'special_effects')
+    for marker in _TECHNIQUE_MARKERS
+}
+
+
 def extract_pxf_stitch_techniques(data):
     """Extract stitch techniques from PXF file"""
     techniques = {
@@ -739,38 +1113,25 @@ def extract_pxf_stitch_techniques(data):
     }
 
     try:
-        # Analyze stitch patterns to determine techniques
-        stitch_patterns = []
-        for i in range(0, len(data) - 12, 4):
-            try:
-                x = struct.unpack('<h', data[i:i + 2])[0]
-                y = struct.unpack('<h', data[i + 2:i + 4])[0]
-                if abs(x) < 10000 and abs(y) < 10000:
-                    stitch_patterns.append((x, y))
-            except:
-                continue
-
-        if len(stitch_patterns) > 10:
+        # Analyze stitch patterns to determine techniques - (x, y) int16
+        # pairs every 4 bytes, only the first 1000 plausible ones are used
+        pair_count = max(0, (len(data) - 9) // 4)
+        pairs = np.frombuffer(data, dtype='<i2',
+                              count=pair_count * 2).reshape(-1, 2)
+        plausible = ((pairs > -10000) & (pairs < 10000)).all(axis=1)
+        stitch_patterns = pairs[plausible][:1000].astype(np.float64)
+
+        if np.count_nonzero(plausible) > 10:
             # Analyze patterns to determine techniques
-            distances = []
-            angles = []
-
-            for i in range(1, min(len(stitch_patterns), 1000)):
-                x1, y1 = stitch_patterns[i - 1]
-                x2, y2 = stitch_patterns[i]
-
-                distance = math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
-                distances.append(distance)
-
-                if x2 != x1:
-                    angle = math.degrees(math.atan2(y2 - y1, x2 - x1))
-                    angles.append(angle)
+            deltas = np.diff(stitch_patterns, axis=0)
+            distances = np.hypot(deltas[:, 0], deltas[:, 1])
+            moving = deltas[deltas[:, 0] != 0]
+            angles = np.degrees(np.arctan2(moving[:, 1], moving[:, 0]))
 
             # Determine fill techniques based on patterns
-            if distances:
-                avg_distance = sum(distances) / len(distances)
-                distance_variance = sum(
-                    (d - avg_distance)**2 for d in distances) / len(distances)
+            if len(distances):
+                avg_distance = distances.mean()
+                distance_variance = distances.var()
 
                 if distance_variance < 100:  # Low variance = consistent spacing
                     techniques['fill_techniques'].append('Uniform Fill')
@@ -786,9 +1147,9 @@ def extract_pxf_stitch_techniques(data):
                     techniques['stitch_types_used'].append('Open Fill')
 
             # Analyze angles for patterns
-            if angles:
-                angle_changes = sum(1 for i in range(1, len(angles))
-                                    if abs(angles[i] - angles[i - 1]) > 45)
+            if len(angles):
+                angle_changes = np.count_nonzero(
+                    np.abs(np.diff(angles)) > 45)
                 if angle_changes > len(angles) * 0.3:
                     techniques['fill_techniques'].append('Cross Hatch')
                     techniques['special_effects'].append(
@@ -797,31 +1158,12 @@ def extract_pxf_stitch_techniques(data):
                     techniques['fill_techniques'].append('Directional Fill')
 
         # Look for specific technique markers in the file
-        technique_markers = {
-            b'SATIN': 'Satin Stitch',
-            b'ZIGZAG': 'Zigzag Fill',
-            b'TATAMI': 'Tatami Fill',
-            b'CROSS': 'Cross Hatch',
-            b'OUTLINE': 'Outline Stitch',
-            b'BEAN': 'Bean Stitch',
-            b'STEM': 'Stem Stitch',
-            b'CHAIN': 'Chain Stitch',
-            b'BLANKET': 'Blanket Stitch',
-            b'APPLIQUE': 'Applique',
-            b'MOTIF': 'Motif Fill',
-            b'RADIAL': 'Radial Fill',
-            b'SPIRAL': 'Spiral Fill',
-            b'CONTOUR': 'Contour Fill'
-        }
 
-        for marker, technique in technique_markers.items():
-            if marker in data:
-                if 'FILL' in marker.decode() or 'TATAMI' in marker.decode():
-                    techniques['fill_techniques'].append(technique)
-                elif 'OUTLINE' in marker.decode() or 'STEM' in marker.decode():
-                    techniques['outline_techniques'].append(technique)
-                else:
-                    techniques['special_effects'].append(technique)
+        # Osobny find() dla każdego markera - markery mogą na siebie
+        # nachodzić (np. "CROSSATIN" zawiera CROSS i SATIN)
+        for marker, technique in _TECHNIQUE_MARKERS.items():
+            if data.find(marker) != -1:
+                techniques[_TECHNIQUE_GROUPS[marker]].append(technique)
 
         # Remove duplicates
         for key in techniques:
@@ -834,6 +1176,21 @@ def extract_pxf_stitch_techniques(data):
     return techniques
 
 
+# Markery ustawień maszyny wyszukiwane w extract_pxf_machine_settings
+_MACHINE_MARKER_RE = re.compile(
+    b'SPEED|speed|TENSION|tension|HOOP|hoop|TAJIMA|BROTHER|BERNINA|'
+    b'HUSQVARNA|JANOME|PFAFF|TRIM|trim')
+# Rozmiary tamborka (mm) w kolejności sprawdzania, z gotowym opisem w cm
+_HOOP_SIZES = {
+    size: '{:.1f}x{:.1f} cm'.format(*(int(v) / 10.0 for v in size.split('x')))
+    for size in ('100x100', '130x180', '150x240', '200x300', '360x200')
+}
+# Producenci maszyn w kolejności pierwszeństwa w jednym oknie
+_MACHINE_TYPES = ((b'TAJIMA', 'Tajima'), (b'BROTHER', 'Brother'),
+                  (b'BERNINA', 'Bernina'), (b'HUSQVARNA', 'Husqvarna Viking'),
+                  (b'JANOME', 'Janome'), (b'PFAFF', 'Pfaff'))
+
+
 def extract_pxf_machine_settings(data):
     """Extract machine settings from PXF file"""
     settings = {
@@ -848,16 +1205,17 @@ def extract_pxf_machine_settings(data):
     }
 
     try:
-        # Look for machine-specific settings
-        for i in range(0, len(data) - 32):
+        # Look for machine-specific settings (only in 32-byte windows
+        # that contain one of the markers)
+        for i in find_marker_windows(data, _MACHINE_MARKER_RE, 32,
+                                     len(data) - 33):
             chunk = data[i:i + 32]
 
             # Look for speed settings
             if b'SPEED' in chunk or b'speed' in chunk:
                 try:
-                    speed_bytes = data[i + 8:i + 12]
-                    if len(speed_bytes) >= 2:
-                        speed = struct.unpack('<H', speed_bytes[:2])[0]
+                    if i + 10 <= len(data):
+                        speed = _UINT16.unpack_from(data, i + 8)[0]
                         if 100 <= speed <= 2000:  # Reasonable speed range
                             settings['machine_speed'] = f"{speed} ściegów/min"
                 except:
@@ -866,9 +1224,8 @@ def extract_pxf_machine_settings(data):
             # Look for tension settings
             if b'TENSION' in chunk or b'tension' in chunk:
                 try:
-                    tension_bytes = data[i + 8:i + 12]
-                    if len(tension_bytes) >= 2:
-                        tension = struct.unpack('<H', tension_bytes[:2])[0]
+                    if i + 10 <= len(data):
+                        tension = _UINT16.unpack_from(data, i + 8)[0]
                         if 1 <= tension <= 100:
                             settings['thread_tension'] = f"Poziom {tension}"
                 except:
@@ -877,32 +1234,16 @@ def extract_pxf_machine_settings(data):
             # Look for hoop size information
             if b'HOOP' in chunk or b'hoop' in chunk:
                 hoop_info = data[i:i + 50].decode('utf-8', errors='ignore')
-                hoop_sizes = [
-                    '100x100', '130x180', '150x240', '200x300', '360x200'
-                ]
-                for size in hoop_sizes:
+                for size, hoop_cm in _HOOP_SIZES.items():
                     if size in hoop_info:
-                        # Konwersja mm na cm
-                        w, h = size.split('x')
-                        w_cm = int(w) / 10.0
-                        h_cm = int(h) / 10.0
-                        settings[
-                            'hoop_dimensions'] = f"{w_cm:.1f}x{h_cm:.1f} cm"
+                        settings['hoop_dimensions'] = hoop_cm
                         break
 
             # Look for machine type
-            if b'TAJIMA' in chunk:
-                settings['machine_type'] = 'Tajima'
-            elif b'BROTHER' in chunk:
-                settings['machine_type'] = 'Brother'
-            elif b'BERNINA' in chunk:
-                settings['machine_type'] = 'Bernina'
-            elif b'HUSQVARNA' in chunk:
-                settings['machine_type'] = 'Husqvarna Viking'
-            elif b'JANOME' in chunk:
-                settings['machine_type'] = 'Janome'
-            elif b'PFAFF' in chunk:
-                settings['machine_type'] = 'Pfaff'
+            for marker, machine_type in _MACHINE_TYPES:
+                if marker in chunk:
+                    settings['machine_type'] = machine_type
+                    break
 
             # Look for trimming settings
             if b'TRIM' in chunk or b'trim' in chunk:
@@ -912,29 +1253,25 @@ def extract_pxf_machine_settings(data):
                 elif 'MANUAL' in trim_info:
                     settings['auto_trim'] = 'Manualne'
 
-        # Analyze jump settings
-        jump_distances = []
-        for i in range(0, len(data) - 8, 4):
-            try:
-                x1 = struct.unpack('<h', data[i:i + 2])[0]
-                y1 = struct.unpack('<h', data[i + 2:i + 4])[0]
-                x2 = struct.unpack('<h', data[i + 4:i + 6])[0]
-                y2 = struct.unpack('<h', data[i + 6:i + 8])[0]
-
-                if all(abs(val) < 10000 for val in [x1, y1, x2, y2]):
-                    distance = math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
-                    if distance > 500:  # Likely a jump
-                        jump_distances.append(distance)
-            except:
-                continue
-
-        if jump_distances:
-            avg_jump = sum(jump_distances) / len(jump_distances)
-            max_jump = max(jump_distances)
+        # Analyze jump settings - consecutive (x, y) int16 pairs every
+        # 4 bytes, both points within a reasonable range
+        pair_count = max(0, (len(data) - 5) // 4 + 1)
+        pairs = np.frombuffer(data, dtype='<i2',
+                              count=pair_count * 2).reshape(-1, 2)
+        plausible = ((pairs > -10000) & (pairs < 10000)).all(axis=1)
+        both = plausible[:-1] & plausible[1:]
+        start = pairs[:-1][both].astype(np.float64)
+        end = pairs[1:][both].astype(np.float64)
+        distances = np.hypot(end[:, 0] - start[:, 0], end[:, 1] - start[:, 1])
+        jump_distances = distances[distances > 500]  # Likely a jump
+
+        if jump_distances.size:
+            avg_jump = float(jump_distances.mean())
+            max_jump = float(jump_distances.max())
             settings['jump_settings'] = {
                 'average_jump': f"{avg_jump/100:.2f} cm",
                 'max_jump': f"{max_jump/100:.2f} cm",
-                'jump_count': len(jump_distances)
+                'jump_count': int(jump_distances.size)
             }
 
     except Exception as e:
@@ -943,35 +1280,120 @@ def extract_pxf_machine_settings(data):
     return settings
 
 
+def scan_pxf_buffer(data, find_colors=True):
+    """Count coordinate patterns and find RGB colors using one byte view of PXF data"""
+    # PXF stores coordinates and commands in 4-byte chunks
+    # (X, Y as little-endian int16) - scan them all at once.
+    # Jeden widok bajtów służy zarówno do współrzędnych, jak i kolorów
+    raw = np.frombuffer(data, dtype=np.uint8)
+    chunk_count = max(0, (len(raw) - 1) // 4)
+    sampled_bytes = min(chunk_count * 4, PXF_COORD_SAMPLE_BYTES)
+    coords = raw[:sampled_bytes].view('<i2').reshape(-1, 2)
+    # Porównania bezpośrednio na int16 - bez kopii int32 i bez np.abs,
+    # które przepełnia się dla -32768
+    xs = coords[:, 0]
+    ys = coords[:, 1]
+
+    # Count potential stitch coordinates (reasonable X,Y values)
+    stitch_patterns = int(np.count_nonzero((xs > -5000) & (xs < 5000) &
+                                           (ys > -5000) & (ys < 5000)))
+
+    # Look for jump patterns (larger coordinate changes)
+    jump_patterns = int(np.count_nonzero((xs > 1000) | (xs < -1000) |
+                                         (ys > 1000) | (ys < -1000)))
+
+    # Przeskaluj próbkę na cały plik
+    if sampled_bytes < chunk_count * 4:
+        scale = chunk_count * 4 / sampled_bytes
+        stitch_patterns = int(stitch_patterns * scale)
+        jump_patterns = int(jump_patterns * scale)
+
+    return {
+        'stitch_patterns': stitch_patterns,
+        'jump_patterns': jump_patterns,
+        'rgb_triples': (find_rgb_triples(raw, limit=20,
+                                         max_bytes=PXF_COLOR_SCAN_BYTES)
+                        if find_colors else [])
+    }
+
+
+def find_rgb_triples(buf, limit=20, max_bytes=None, block_size=64 * 1024):
+    """Find first unique RGB triples (bytes at offsets 0, 3, 6, ...) in a uint8 array"""
+    # Pierwotna pętla zawsze przesuwała się o 3 bajty (warunki <= 255 są
+    # zawsze prawdziwe), więc trójki nie nachodzą na siebie
+    end = len(buf) - 6
+    if max_bytes is not None:
+        end = min(end, max_bytes)
+    triple_count = len(range(0, max(end, 0), 3))
+    triples = buf[:triple_count * 3].reshape(-1, 3)
+    found = []
+    seen = set()
+
+    # Skanuj blokami, żeby zakończyć po znalezieniu `limit` kolorów
+    for start in range(0, triple_count, block_size):
+        block = triples[start:start + block_size].astype(np.uint32)
+        r, g, b = block[:, 0], block[:, 1], block[:, 2]
+
+        # Skip very dark colors (likely not thread colors)
+        packed = ((r << 16) | (g << 8) | b)[r + g + b > 50]
+        if packed.size == 0:
+            continue
+
+        # Unikalne wartości w kolejności pierwszego wystąpienia
+        values, first_pos = np.unique(packed, return_index=True)
+        for value in values[np.argsort(first_pos)].tolist():
+            if value not in seen:
+                seen.add(value)
+                found.append((value >> 16, (value >> 8) & 0xFF, value & 0xFF))
+                if len(found) >= limit:
+                    return found
+
+    return found
+
+
+# Przybliżone nazwy kolorów: (nazwa, (r_min, r_max), (g_min, g_max), (b_min, b_max))
+# Granice są wyłączne, pierwsza pasująca reguła wygrywa
+_COLOR_RULES = [
+    ("Red", (200, 256), (-1, 100), (-1, 100)),
+    ("Green", (-1, 100), (200, 256), (-1, 100)),
+    ("Blue", (-1, 100), (-1, 100), (200, 256)),
+    ("Yellow", (200, 256), (200, 256), (-1, 100)),
+    ("Purple", (150, 256), (-1, 100), (150, 256)),
+    ("Cyan", (-1, 100), (150, 256), (150, 256)),
+    ("Orange", (200, 256), (100, 256), (-1, 100)),
+    ("White", (200, 256), (200, 256), (200, 256)),
+    ("Black", (-1, 50), (-1, 50), (-1, 50)),
+    ("Gray", (100, 200), (100, 200), (100, 200)),
+    ("Unknown", (-1, 256), (-1, 256), (-1, 256)),
+]
+_COLOR_NAMES = [rule[0] for rule in _COLOR_RULES]
+_COLOR_BOUNDS = np.array([rule[1:] for rule in _COLOR_RULES], dtype=np.int16)
+
+
+def get_color_names(rgb):
+    """Get approximate color names for an (N, 3) array of RGB values"""
+    rgb = np.asarray(rgb, dtype=np.int16).reshape(-1, 1, 3)
+    matches = ((rgb > _COLOR_BOUNDS[:, :, 0]) &
+               (rgb < _COLOR_BOUNDS[:, :, 1])).all(axis=2)
+    return [_COLOR_NAMES[i] for i in matches.argmax(axis=1)]
+
+
 def get_color_name(r, g, b):
     """Get approximate color name from RGB values"""
-    # Simple color name mapping
-    if r > 200 and g < 100 and b < 100:
-        return "Red"
-    elif r < 100 and g > 200 and b < 100:
-        return "Green"
-    elif r < 100 and g < 100 and b > 200:
-        return "Blue"
-    elif r > 200 and g > 200 and b < 100:
-        return "Yellow"
-    elif r > 150 and g < 100 and b > 150:
-        return "Purple"
-    elif r < 100 and g > 150 and b > 150:
-        return "Cyan"
-    elif r > 200 and g > 100 and b < 100:
-        return "Orange"
-    elif r > 200 and g > 200 and b > 200:
-        return "White"
-    elif r < 50 and g < 50 and b < 50:
-        return "Black"
-    elif 100 < r < 200 and 100 < g < 200 and 100 < b < 200:
-        return "Gray"
-    else:
-        return "Unknown"
+    return get_color_names([(r, g, b)])[0]
+
 
+# Komendy zliczane w statystykach ściegów
+_STITCH_COMMAND_LABELS = {
+    pyembroidery.STITCH: 'Normal Stitch',
+    pyembroidery.JUMP: 'Jump',
+    pyembroidery.COLOR_CHANGE: 'Color Change',
+    pyembroidery.TRIM: 'Trim'
+}
 
-def analyze_stitch_details(pattern):
-    """Analyze detailed stitch information"""
+
+def analyze_stitch_details(pattern, stitches=None):
+    """Analyze detailed stitch information (stitches: optional (N, 3) array)"""
     stats = {
         'total_stitches': len(pattern.stitches),
         'stitch_commands': {},
@@ -987,53 +1409,37 @@ def analyze_stitch_details(pattern):
     if len(pattern.stitches) == 0:
         return stats
 
-    # Count different stitch types and calculate distances
-    prev_x, prev_y = None, None
-    stitch_distances = []
-    jump_distances = []
-
-    for stitch in pattern.stitches:
-        if len(stitch) >= 3:
-            x, y, command = stitch[0], stitch[1], stitch[2]
-
-            # Count command types
-            if command == pyembroidery.STITCH:
-                stats['stitch_commands'][
-                    'Normal Stitch'] = stats['stitch_commands'].get(
-                        'Normal Stitch', 0) + 1
-            elif command == pyembroidery.JUMP:
-                stats['jump_count'] += 1
-                stats['stitch_commands'][
-                    'Jump'] = stats['stitch_commands'].get('Jump', 0) + 1
-            elif command == pyembroidery.COLOR_CHANGE:
-                stats['color_changes'] += 1
-                stats['stitch_commands'][
-                    'Color Change'] = stats['stitch_commands'].get(
-                        'Color Change', 0) + 1
-            elif command == pyembroidery.TRIM:
-                stats['trims'] += 1
-                stats['stitch_commands'][
-                    'Trim'] = stats['stitch_commands'].get('Trim', 0) + 1
-
-            # Calculate distances
-            if prev_x is not None and prev_y is not None:
-                distance = ((x - prev_x)**2 + (y - prev_y)**2)**0.5
-
-                if command == pyembroidery.JUMP:
-                    jump_distances.append(distance)
-                    stats['max_jump_distance'] = max(
-                        stats['max_jump_distance'], distance)
-                elif command == pyembroidery.STITCH:
-                    stitch_distances.append(distance)
-                    stats['total_thread_length'] += distance
-
-            prev_x, prev_y = x, y
+    # Count different stitch types and calculate distances (x, y, command)
+    if stitches is None:
+        stitches = np.asarray(pattern.stitches, dtype=np.float64)
+    commands = stitches[:, 2].astype(np.int64)
+
+    # Count command types (in order of first appearance)
+    codes, first_index, counts = np.unique(commands,
+                                           return_index=True,
+                                           return_counts=True)
+    for i in np.argsort(first_index):
+        code = int(codes[i])
+        if code in _STITCH_COMMAND_LABELS:
+            stats['stitch_commands'][_STITCH_COMMAND_LABELS[code]] = int(
+                counts[i])
+
+    stats['jump_count'] = stats['stitch_commands'].get('Jump', 0)
+    stats['color_changes'] = stats['stitch_commands'].get('Color Change', 0)
+    stats['trims'] = stats['stitch_commands'].get('Trim', 0)
+
+    # Calculate distances from the previous stitch
+    distances = np.hypot(np.diff(stitches[:, 0]), np.diff(stitches[:, 1]))
+    stitch_distances = distances[commands[1:] == pyembroidery.STITCH]
+    jump_distances = distances[commands[1:] == pyembroidery.JUMP]
+
+    stats['max_jump_distance'] = float(jump_distances.max(initial=0))
+    stats['total_thread_length'] = float(stitch_distances.sum())
 
     # Calculate averages (jednostki w cm)
-    if stitch_distances:
+    if stitch_distances.size:
         stats['avg_stitch_length'] = round(
-            sum(stitch_distances) / len(stitch_distances) / 100,
-            3)  # Convert to cm
+            float(stitch_distances.mean()) / 100, 3)  # Convert to cm
 
     # Convert thread length to cm and then to more readable units
     stats['total_thread_length'] = round(stats['total_thread_length'] / 100,
@@ -1094,7 +1500,7 @@ def analyze_technical_specs(pattern, dimensions):
     return tech_info
 
 
-def calculate_performance_metrics(pattern, dimensions):
+def calculate_performance_metrics(pattern, dimensions, stitch_stats):
     """Calculate performance and time metrics"""
     metrics = {
         'estimated_time': {},
@@ -1121,12 +1527,9 @@ def calculate_performance_metrics(pattern, dimensions):
     # Factor in color changes, trims, and jumps
     base_time_minutes = stitch_count / 600  # Conservative estimate
 
-    # Add time for color changes and trims
-    color_changes = sum(
-        1 for stitch in pattern.stitches
-        if len(stitch) >= 3 and stitch[2] == pyembroidery.COLOR_CHANGE)
-    trims = sum(1 for stitch in pattern.stitches
-                if len(stitch) >= 3 and stitch[2] == pyembroidery.TRIM)
+    # Add time for color changes and trims (counted by analyze_stitch_details)
+    color_changes = stitch_stats['color_changes']
+    trims = stitch_stats['trims']
 
     # Each color change adds ~30 seconds, each trim adds ~10 seconds
     additional_time = (color_changes * 0.5) + (trims * 0.17)
@@ -1147,8 +1550,7 @@ def calculate_performance_metrics(pattern, dimensions):
         'setup'] = f"{round(additional_time * 60)} sekund"
 
     # Thread efficiency (lower jump-to-stitch ratio is better)
-    jumps = sum(1 for stitch in pattern.stitches
-                if len(stitch) >= 3 and stitch[2] == pyembroidery.JUMP)
+    jumps = stitch_stats['jump_count']
     if stitch_count > 0:
         metrics['thread_efficiency'] = round((1 - jumps / stitch_count) * 100,
                                              1)
@@ -1193,30 +1595,67 @@ def convert_pxf_to_dst(pxf_file_path):
         return None
 
 
-def analyze_embroidery_file(file_path):
-    """Analyze embroidery file using multiple approaches"""
+# Nazwy komend pyembroidery wyświetlane jako typy ściegów
+_COMMAND_NAMES = {
+    pyembroidery.STITCH: 'Normal Stitch',
+    pyembroidery.JUMP: 'Jump',
+    pyembroidery.COLOR_CHANGE: 'Color Change',
+    pyembroidery.TRIM: 'Trim',
+    pyembroidery.END: 'End',
+    pyembroidery.COLOR_BREAK: 'Color Break',
+    pyembroidery.STITCH_BREAK: 'Stitch Break'
+}
+
+
+# Rozszerzenia, dla których pyembroidery ma czytnik (bez kropki)
+_PYEMBROIDERY_READABLE = frozenset(
+    file_format['extension'] for file_format in pyembroidery.supported_formats()
+    if file_format.get('reader'))
+
+
+def analyze_embroidery_file(file_path, *, file_ext=None, content_key=None):
+    """Analyze embroidery file using multiple approaches (file_ext: '.dst' etc.)"""
     try:
         # Log file information for debugging
         logging.info(f"Analyzing file: {file_path}")
-        logging.info(f"File size: {os.path.getsize(file_path)} bytes")
 
-        # Check if file exists and is not empty
-        if not os.path.exists(file_path):
+        # Check if file exists and is not empty (one stat call)
+        try:
+            file_size = os.stat(file_path).st_size
+        except FileNotFoundError:
             return None, "File does not exist"
+        logging.info(f"File size: {file_size} bytes")
 
-        if os.path.getsize(file_path) == 0:
+        if file_size == 0:
             return None, "File is empty"
 
-        file_ext = os.path.splitext(file_path)[1].lower()
+        # Rozszerzenie zwykle podaje wywołujący (już je wyznaczył)
+        if file_ext is None:
+            file_ext = os.path.splitext(file_path)[1].lower()
+
+        # Nagłówek PXF odczytaj raz - służy do rozpoznania wariantu formatu
+        header = b''
+        if file_ext == '.pxf':
+            with open(file_path, 'rb') as f:
+                header = f.read(32)
 
-        # Try to read the embroidery file with pyembroidery first
-        pattern = pyembroidery.read(file_path)
+            # Bez sygnatury PMLPXF/PXF nie ma czego parsować
+            if not header.startswith(PXF_SIGNATURES):
+                logging.info(f"File header (first 32 bytes): {header}")
+                return None, "pxf_invalid_structure"
+
+        # Try to read the embroidery file with pyembroidery first (only
+        # formats it has a reader for - PXF goes straight to our analysis)
+        readable = file_ext[1:] in _PYEMBROIDERY_READABLE
+        pattern = pyembroidery.read(file_path) if readable else None
 
         if pattern is None and file_ext == '.pxf':
             # For PXF files that failed to read, try conversion first
-            logging.info(
-                "Attempting PXF to DST conversion for detailed analysis")
-            dst_file = convert_pxf_to_dst(file_path)
+            dst_file = None
+            if readable:
+                logging.info(
+                    "Attempting PXF to DST conversion for detailed analysis")
+                dst_file = convert_pxf_to_dst(file_path)
 
             if dst_file and os.path.exists(dst_file):
                 # Try to analyze the converted DST file
@@ -1240,14 +1679,12 @@ def analyze_embroidery_file(file_path):
 
             # If conversion failed, try basic analysis
             if pattern is None:
-                pxf_analysis = try_pxf_analysis(file_path)
+                pxf_analysis = try_pxf_analysis(file_path, content_key)
                 if pxf_analysis:
                     return pxf_analysis, None
 
                 # If alternative analysis fails, check the header for error type
-                with open(file_path, 'rb') as f:
-                    header = f.read(32)
-                    logging.info(f"File header (first 32 bytes): {header}")
+                logging.info(f"File header (first 32 bytes): {header}")
 
                 if header.startswith(b'PMLPXF'):
                     return None, "pxf_unsupported_variant"
@@ -1272,46 +1709,30 @@ def analyze_embroidery_file(file_path):
             'performance_metrics': {}
         }
 
-        # Extract thread colors
-        for i, thread in enumerate(pattern.threadlist):
-            color_info = {
-                'index': i + 1,
-                'color': thread.color if thread.color else 'Unknown',
-                'hex':
-                thread.hex if hasattr(thread, 'hex') and thread.hex else 'N/A',
-                'description':
-                thread.description if thread.description else 'N/A',
-                'brand': thread.brand if thread.brand else 'N/A'
-            }
-            analysis['colors'].append(color_info)
-
-        # Extract stitch types
-        stitch_types = set()
-        for stitch in pattern.stitches:
-            if len(stitch) >= 3:  # x, y, command
-                command = stitch[2]
-                if command == pyembroidery.STITCH:
-                    stitch_types.add('Normal Stitch')
-                elif command == pyembroidery.JUMP:
-                    stitch_types.add('Jump')
-                elif command == pyembroidery.COLOR_CHANGE:
-                    stitch_types.add('Color Change')
-                elif command == pyembroidery.TRIM:
-                    stitch_types.add('Trim')
-                elif command == pyembroidery.END:
-                    stitch_types.add('End')
-                elif command == pyembroidery.COLOR_BREAK:
-                    stitch_types.add('Color Break')
-                elif command == pyembroidery.STITCH_BREAK:
-                    stitch_types.add('Stitch Break')
-                else:
-                    stitch_types.add(f'Command {command}')
-
-        analysis['stitch_types'] = list(stitch_types)
+        # Extract thread colors (plain dicts - results are also stored as JSON)
+        analysis['colors'] = [{
+            'index': i + 1,
+            'color': thread.color or 'Unknown',
+            'hex': getattr(thread, 'hex', None) or 'N/A',
+            'description': thread.description or 'N/A',
+            'brand': thread.brand or 'N/A'
+        } for i, thread in enumerate(pattern.threadlist)]
+
+        # Extract stitch types (x, y, command) - one unique pass over the commands
+        stitches = np.asarray(pattern.stitches, dtype=np.float64).reshape(-1, 3)
+        analysis['stitch_types'] = [
+            _COMMAND_NAMES.get(code, f'Command {code}')
+            for code in np.unique(stitches[:, 2].astype(np.int64)).tolist()
+        ]
 
         # Get pattern dimensions
-        extends = pattern.extends()
-        if extends:
+        # Granice wzoru (min_x, min_y, max_x, max_y) z tablicy ściegów
+        # zamiast pętli pattern.extends() po wszystkich ściegach
+        if len(stitches):
+            extends = [
+                float(v) for v in (*stitches[:, :2].min(axis=0),
+                                   *stitches[:, :2].max(axis=0))
+            ]
             width = extends[2] - extends[0]  # max_x - min_x
             height = extends[3] - extends[1]  # max_y - min_y
             analysis['dimensions'] = {
@@ -1325,7 +1746,7 @@ def analyze_embroidery_file(file_path):
             }
 
         # Detailed stitch analysis
-        stitch_stats = analyze_stitch_details(pattern)
+        stitch_stats = analyze_stitch_details(pattern, stitches)
         analysis['detailed_stats'] = stitch_stats
 
         # Technical information
@@ -1334,7 +1755,8 @@ def analyze_embroidery_file(file_path):
 
         # Performance metrics
         performance = calculate_performance_metrics(pattern,
-                                                    analysis['dimensions'])
+                                                    analysis['dimensions'],
+                                                    stitch_stats)
         analysis['performance_metrics'] = performance
 
         # Try to extract layer information (if available)
@@ -1356,6 +1778,31 @@ def analyze_embroidery_file(file_path):
         return None, f"Error analyzing file: {str(e)}"
 
 
+def render_analysis(analysis, error, filename):
+    """Render the analysis result page or the matching error response"""
+    if analysis:
+        analysis = dict(analysis, filename=filename)
+
+    if error:
+        if error == 'pxf_unsupported_variant':
+            return render_template('pxf_error.html',
+                                   error_type='unsupported_variant',
+                                   filename=filename)
+        elif error == 'pxf_invalid_structure':
+            return render_template('pxf_error.html',
+                                   error_type='invalid_structure',
+                                   filename=filename)
+        else:
+            flash(f'Błąd podczas przetwarzania pliku: {error}', 'error')
+            return redirect(url_for('index'))
+
+    if analysis is None:
+        flash('Nie można przeanalizować pliku hafciarskiego', 'error')
+        return redirect(url_for('index'))
+
+    return render_template('results.html', analysis=analysis)
+
+
 @app.route('/')
 def index():
     """Main page with upload form"""
@@ -1382,38 +1829,79 @@ def upload_file():
         return redirect(url_for('index'))
 
     try:
-        # Save file temporarily
+        # Save file temporarily (unique name, original extension for pyembroidery)
         filename = secure_filename(file.filename)
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(temp_path)
-
-        # Analyze the file
-        analysis, error = analyze_embroidery_file(temp_path)
+        file_ext = '.' + file.filename.rpartition('.')[2].lower()
 
-        # Clean up temporary file
-        try:
-            os.remove(temp_path)
-        except OSError:
-            logging.warning(f"Could not remove temporary file: {temp_path}")
-
-        if error:
-            if error == 'pxf_unsupported_variant':
-                return render_template('pxf_error.html',
-                                       error_type='unsupported_variant',
-                                       filename=filename)
-            elif error == 'pxf_invalid_structure':
+        # Sprawdź sygnaturę PXF przed zapisem pliku
+        if file_ext == '.pxf':
+            magic = file.stream.read(8)
+            file.stream.seek(0)
+            if not magic.startswith(PXF_SIGNATURES):
                 return render_template('pxf_error.html',
                                        error_type='invalid_structure',
                                        filename=filename)
-            else:
-                flash(f'Błąd podczas przetwarzania pliku: {error}', 'error')
-                return redirect(url_for('index'))
 
-        if analysis is None:
-            flash('Nie można przeanalizować pliku hafciarskiego', 'error')
-            return redirect(url_for('index'))
+        fd, temp_path = tempfile.mkstemp(suffix=file_ext,
+                                         dir=app.config['UPLOAD_FOLDER'])
+        content_hash = new_content_hash()
+        file_size = 0
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                # Kopiuj strumień blokami 1 MiB, licząc przy okazji hash
+                # zawartości
+                while True:
+                    block = file.stream.read(1 << 20)
+                    if not block:
+                        break
+                    content_hash.update(block)
+                    file_size += len(block)
+                    temp_file.write(block)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        # Analyze the file (the same content is served from cache)
+        content_key = content_hash.hexdigest()
+        cache_key = file_ext + ':' + content_key
+        cached = get_cached_analysis(cache_key)
+        if cached is None and file_size >= BACKGROUND_ANALYSIS_MIN_SIZE:
+            # Duży plik - analizuj w tle i pokaż stronę postępu
+            job_id = uuid.uuid4().hex
+            try:
+                write_job_state(job_id, {
+                    'status': 'pending',
+                    'filename': filename,
+                    'temp_path': temp_path,
+                    'submitted_at': time.time()
+                })
+                future = submit_background_analysis(job_id, temp_path,
+                                                    filename, content_key)
+            except BaseException:
+                # Zadanie nie wystartowało - nie zostawiaj pliku ani stanu
+                remove_job_files(job_id, temp_path)
+                raise
+            future.add_done_callback(
+                functools.partial(finish_background_analysis, job_id,
+                                  filename, cache_key))
+            return redirect(url_for('analysis_result', job_id=job_id))
 
-        return render_template('results.html', analysis=analysis)
+        try:
+            if cached is None:
+                cached = analyze_embroidery_file(temp_path,
+                                                 file_ext=file_ext,
+                                                 content_key=content_key)
+                store_cached_analysis(cache_key, cached)
+        finally:
+            # Clean up temporary file (also when the analysis fails)
+            try:
+                os.remove(temp_path)
+            except OSError:
+                logging.warning(
+                    f"Could not remove temporary file: {temp_path}")
+        analysis, error = cached
+
+        return render_analysis(analysis, error, filename)
 
     except Exception as e:
         logging.error(f"Upload error: {str(e)}")
@@ -1422,6 +1910,39 @@ def upload_file():
         return redirect(url_for('index'))
 
 
+@app.route('/result/<job_id>')
+def analysis_result(job_id):
+    """Show the result of a background analysis or its progress page"""
+    job_path = job_result_path(job_id)
+    try:
+        if not _JOB_ID_RE.fullmatch(job_id):
+            raise ValueError(job_id)
+        with open(job_path, encoding='utf-8') as job_file:
+            job = json.load(job_file)
+    except (OSError, ValueError):
+        flash('Wynik analizy nie jest już dostępny', 'error')
+        return redirect(url_for('index'))
+
+    if job['status'] == 'pending':
+        if time.time() - job.get('submitted_at', 0) <= BACKGROUND_JOB_TIMEOUT:
+            return render_template('processing.html',
+                                   job_id=job_id,
+                                   filename=job['filename'])
+
+        # Proces analizy zniknął bez zapisania wyniku
+        logging.warning(f"Background analysis job {job_id} is stale")
+        remove_job_files(job_id, job.get('temp_path'))
+        flash('Analiza pliku została przerwana - spróbuj ponownie', 'error')
+        return redirect(url_for('index'))
+
+    try:
+        os.remove(job_path)
+    except OSError:
+        logging.warning(f"Could not remove job result: {job_path}")
+
+    return render_analysis(job['analysis'], job['error'], job['filename'])
+
+
 @app.errorhandler(413)
 def too_large(e):
     """Handle file too large error"""
@@ -1430,4 +1951,6 @@ def too_large(e):
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    # Serwer deweloperski; produkcyjnie: gunicorn -c gunicorn_conf.py main:app
+    app.run(host='0.0.0.0', port=5001,
+            debug=os.environ.get('FLASK_ENV') == 'development')
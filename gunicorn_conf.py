@@ -0,0 +1,18 @@
+"""Gunicorn configuration for the embroidery file analyzer"""
+import os
+
+# Jeden proces na rdzeń - analiza plików obciąża CPU
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+# Każdy worker ma też własną pulę procesów do analizy dużych plików
+# (ANALYSIS_WORKERS w app.py, domyślnie 1)
+worker_class = 'gthread'
+threads = 4
+
+# W workerach gthread to tylko heartbeat procesu, a nie limit czasu żądania.
+# Limit analizy PXF (10 minut) egzekwuje PXFAnalyzer - PXF_ANALYSIS_TIMEOUT
+# w app.py
+timeout = 600
+
+# Okresowo odnawiaj workery
+max_requests = 1000
+max_requests_jitter = 100
@@ -4,21 +4,78 @@ Zaawansowany analizator plików PXF
 Specjalizuje się w formatach PMLPXF i innych wariantach PXF
 """
 
+import math
+import mmap
 import struct
 import logging
 import re
-from typing import Dict, List, Any, Optional, Tuple
+import time
+from collections import Counter
+from typing import Dict, Iterator, List, Any, Optional, Tuple, Union
+
+# Prekompilowane formaty pól binarnych (little-endian)
+_UINT16 = struct.Struct('<H')
+_UINT32 = struct.Struct('<I')
+_FLOAT32 = struct.Struct('<f')
+# Nagłówek PMLPXF od offsetu 8: rozmiar nagłówka, rozmiar danych, 4 wymiary,
+# liczba kolorów, liczba ściegów, flagi
+_PMLPXF_HEADER = struct.Struct('<9I')
+_STITCH_XYC = struct.Struct('<2hH')
+_STITCH_RECORD_XY = struct.Struct('<2h2x')
+
+# Znaczniki sekcji kolorów i ściegów (szukane w całym pliku)
+_COLOR_SECTION_RE = re.compile(b'CLRS|COLR')
+_STITCH_SECTION_RE = re.compile(b'STCH')
+
+# Wzorce dla różnych parametrów haftu (wyszukiwane w oknach tekstu pliku)
+_TEXT_PATTERNS = {
+    param_type: [re.compile(pattern) for pattern in patterns]
+    for param_type, patterns in {
+        'density': [r'(?:density|gęstość)[:\s=]*(\d+\.?\d*)',
+                    r'row[_\s]*spacing[:\s=]*(\d+\.?\d*)',
+                    r'pitch[:\s=]*(\d+\.?\d*)'],
+        'underlay': [r'(?:underlay|podkład)[:\s=]*(\w+)',
+                     r'auto[_\s]*underlay[:\s=]*(\w+)'],
+        'angle': [r'(?:angle|kąt|direction)[:\s=]*(\d+\.?\d*)',
+                  r'fill[_\s]*angle[:\s=]*(\d+\.?\d*)'],
+        'stitch_length': [r'(?:stitch[_\s]*length|długość[_\s]*ściegu)[:\s=]*(\d+\.?\d*)',
+                          r'max[_\s]*stitch[:\s=]*(\d+\.?\d*)'],
+        'machine_speed': [r'(?:speed|prędkość|velocity)[:\s=]*(\d+)',
+                          r'machine[_\s]*speed[:\s=]*(\d+)',
+                          r'rpm[:\s=]*(\d+)'],
+        'thread_weight': [r'(?:thread[_\s]*weight|waga[_\s]*nici)[:\s=]*(\d+)',
+                          r'weight[:\s=]*(\d+)wt',
+                          r'wt[:\s=]*(\d+)']
+    }.items()
+}
+_WEIGHT_PATTERN = re.compile(r'(?:weight|wt)[:\s=]*(\d+)')
+
 
 class PXFAnalyzer:
     """Klasa do zaawansowanej analizy plików PXF"""
     
-    def __init__(self, data: bytes):
+    def __init__(self, data: Union[bytes, mmap.mmap], text_content: Optional[str] = None,
+                 deadline: Optional[float] = None):
         self.data = data
+        self._text_content = text_content
+        # Termin (time.monotonic()), po którym analiza zgłasza TimeoutError
+        self.deadline = deadline
         self.file_size = len(data)
         self.header_info = {}
         self.sections = {}
         self.parameters = {}
         
+    def _get_text_content(self) -> str:
+        """Zwraca zawartość pliku jako tekst UTF-8 (dekodowaną tylko raz)"""
+        if self._text_content is None:
+            self._text_content = str(self.data, 'utf-8', errors='ignore')
+        return self._text_content
+        
+    def _check_deadline(self) -> None:
+        """Przerywa analizę po przekroczeniu terminu (działa w każdym wątku)"""
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise TimeoutError("Analysis timed out - plik może być zbyt duży lub złożony")
+
     def analyze(self) -> Dict[str, Any]:
         """Główna metoda analizy pliku PXF"""
         results = {
@@ -48,16 +105,21 @@ class PXFAnalyzer:
                 results['embroidery_parameters'] = self._extract_generic_parameters()
             
             # Analiza danych ściegów
+            self._check_deadline()
             results['stitch_data'] = self._analyze_stitch_data()
             
             # Analiza ustawień maszyny
+            self._check_deadline()
             results['machine_settings'] = self._extract_machine_settings()
             
             # Specyfikacje techniczne
+            self._check_deadline()
             results['technical_specs'] = self._calculate_technical_specs()
             
             results['analysis_success'] = True
             
+        except TimeoutError:
+            raise  # Limit czasu przerywa całą analizę
         except Exception as e:
             logging.error(f"Błąd w analizie PXF: {e}")
             results['error'] = str(e)
@@ -66,14 +128,14 @@ class PXFAnalyzer:
     
     def _identify_format(self) -> Dict[str, str]:
         """Identyfikuje typ formatu PXF"""
-        if self.data.startswith(b'PMLPXF'):
+        if self.data[:6] == b'PMLPXF':
             version = self.data[6:8]
             return {
                 'type': 'PMLPXF',
                 'version': version.decode('ascii', errors='ignore'),
                 'description': 'Tajima PMLPXF format'
             }
-        elif self.data.startswith(b'PXF'):
+        elif self.data[:3] == b'PXF':
             return {
                 'type': 'PXF',
                 'version': 'Unknown',
@@ -97,42 +159,30 @@ class PXFAnalyzer:
             # Podstawowe informacje z nagłówka
             header['signature'] = self.data[0:8].decode('ascii', errors='ignore')
             
-            # Rozmiar nagłówka (offset 8-12)
-            header_size = struct.unpack('<I', self.data[8:12])[0]
-            header['header_size'] = header_size
+            # Pola nagłówka (offset 8-44) odczytane jednym wywołaniem
+            (header_size, data_size, width, height, x_offset, y_offset,
+             color_count, stitch_count, flags) = _PMLPXF_HEADER.unpack_from(
+                 self.data, 8)
             
-            # Rozmiar danych (offset 12-16)
-            if len(self.data) >= 16:
-                data_size = struct.unpack('<I', self.data[12:16])[0]
-                header['data_size'] = data_size
+            header['header_size'] = header_size
+            header['data_size'] = data_size
             
             # Wymiary wzoru (offset 16-32)
-            if len(self.data) >= 32:
-                dims = struct.unpack('<4I', self.data[16:32])
-                header['dimensions'] = {
-                    'width': dims[0] / 100.0,  # w mm
-                    'height': dims[1] / 100.0,  # w mm
-                    'x_offset': dims[2] / 100.0,
-                    'y_offset': dims[3] / 100.0
-                }
-            
-            # Liczba kolorów (offset 32-36)
-            if len(self.data) >= 36:
-                color_count = struct.unpack('<I', self.data[32:36])[0]
-                header['color_count'] = color_count
+            header['dimensions'] = {
+                'width': width / 100.0,  # w mm
+                'height': height / 100.0,  # w mm
+                'x_offset': x_offset / 100.0,
+                'y_offset': y_offset / 100.0
+            }
             
-            # Liczba ściegów (offset 36-40)
-            if len(self.data) >= 40:
-                stitch_count = struct.unpack('<I', self.data[36:40])[0]
-                header['stitch_count'] = stitch_count
+            header['color_count'] = color_count
+            header['stitch_count'] = stitch_count
             
             # Flagi formatu (offset 40-44)
-            if len(self.data) >= 44:
-                flags = struct.unpack('<I', self.data[40:44])[0]
-                header['format_flags'] = flags
-                header['has_underlay'] = bool(flags & 0x01)
-                header['has_applique'] = bool(flags & 0x02)
-                header['has_sequins'] = bool(flags & 0x04)
+            header['format_flags'] = flags
+            header['has_underlay'] = bool(flags & 0x01)
+            header['has_applique'] = bool(flags & 0x02)
+            header['has_sequins'] = bool(flags & 0x04)
             
         except struct.error as e:
             header['error'] = f'Błąd parsowania nagłówka: {e}'
@@ -164,53 +214,51 @@ class PXFAnalyzer:
         
         return sections
     
+    def _section_marker_positions(self, marker_re) -> Iterator[int]:
+        """Pozycje znaczników sekcji, po których mieści się jeszcze 16 bajtów"""
+        last_start = len(self.data) - 17
+        for match in marker_re.finditer(self.data, 0, max(0, last_start + 4)):
+            yield match.start()
+    
     def _find_color_section(self) -> Optional[Dict[str, Any]]:
         """Znajduje sekcję kolorów w pliku"""
-        for i in range(0, len(self.data) - 16):
-            # Szukamy znaczników kolorów
-            if self.data[i:i+4] == b'CLRS' or self.data[i:i+4] == b'COLR':
-                try:
-                    # Liczba kolorów
-                    color_count = struct.unpack('<I', self.data[i+4:i+8])[0]
-                    if 1 <= color_count <= 256:  # Rozsądna liczba kolorów
-                        colors = []
-                        offset = i + 8
-                        
-                        for j in range(color_count):
-                            if offset + 4 <= len(self.data):
-                                # RGB + alfa lub indeks
-                                color_data = struct.unpack('<I', self.data[offset:offset+4])[0]
-                                colors.append({
-                                    'index': j,
-                                    'rgb': f"#{color_data:06X}",
-                                    'raw_value': color_data
-                                })
-                                offset += 4
-                        
-                        return {
-                            'position': i,
-                            'count': color_count,
-                            'colors': colors
-                        }
-                except struct.error:
-                    continue
+        # Szukamy znaczników kolorów
+        for i in self._section_marker_positions(_COLOR_SECTION_RE):
+            # Liczba kolorów (i + 8 <= len - 8, więc odczyt jest bezpieczny)
+            color_count = _UINT32.unpack_from(self.data, i+4)[0]
+            if 1 <= color_count <= 256:  # Rozsądna liczba kolorów
+                colors = []
+                offset = i + 8
+                
+                for j in range(color_count):
+                    if offset + 4 <= len(self.data):
+                        # RGB + alfa lub indeks
+                        color_data = _UINT32.unpack_from(self.data, offset)[0]
+                        colors.append({
+                            'index': j,
+                            'rgb': f"#{color_data:06X}",
+                            'raw_value': color_data
+                        })
+                        offset += 4
+                
+                return {
+                    'position': i,
+                    'count': color_count,
+                    'colors': colors
+                }
         
         return None
     
     def _find_stitch_section(self) -> Optional[Dict[str, Any]]:
         """Znajduje sekcję ściegów"""
-        for i in range(0, len(self.data) - 16):
-            if self.data[i:i+4] == b'STCH' or self.data[i:i+4] == b'STITCHES':
-                try:
-                    stitch_count = struct.unpack('<I', self.data[i+4:i+8])[0]
-                    if 1 <= stitch_count <= 1000000:  # Rozsądna liczba ściegów
-                        return {
-                            'position': i,
-                            'count': stitch_count,
-                            'data_start': i + 8
-                        }
-                except struct.error:
-                    continue
+        for i in self._section_marker_positions(_STITCH_SECTION_RE):
+            stitch_count = _UINT32.unpack_from(self.data, i+4)[0]
+            if 1 <= stitch_count <= 1000000:  # Rozsądna liczba ściegów
+                return {
+                    'position': i,
+                    'count': stitch_count,
+                    'data_start': i + 8
+                }
         
         return None
     
@@ -267,9 +315,14 @@ class PXFAnalyzer:
                 'trim_commands': [],
                 'color_change_counts': []
             }
+            # Zbiory do szybkiego sprawdzania duplikatów (O(1) zamiast listy)
+            seen_underlay_types = set()
+            seen_stitch_types = set()
             
             # Ultra-dokładna analiza z maksymalnym oknem i szczegółowym wykrywaniem
             for i in range(0, len(self.data) - 256, 1):  # Analizujemy każdy bajt z ogromnym oknem
+                if not i & 0xFFFF:
+                    self._check_deadline()
                 chunk = self.data[i:i+256]  # Ogromny chunk dla ultra-dokładnego wykrywania
                 text_chunk = chunk.decode('utf-8', errors='ignore').lower()  # Analiza tekstowa
                 
@@ -290,7 +343,7 @@ class PXFAnalyzer:
                         try:
                             # Format 1: Float (najpopularniejszy)
                             if offset + 4 <= len(chunk):
-                                density_f = struct.unpack('<f', chunk[offset:offset+4])[0]
+                                density_f = _FLOAT32.unpack_from(chunk, offset)[0]
                                 if 0.01 <= density_f <= 100:
                                     density_cm = density_f / 10.0 if density_f > 10 else density_f
                                     all_parameters['density_values'].append(density_cm)
@@ -298,7 +351,7 @@ class PXFAnalyzer:
                             
                             # Format 2: Integer (mikrometry)
                             if offset + 4 <= len(chunk):
-                                density_i = struct.unpack('<I', chunk[offset:offset+4])[0]
+                                density_i = _UINT32.unpack_from(chunk, offset)[0]
                                 if 50 <= density_i <= 10000:  # mikrometry
                                     density_cm = density_i / 1000.0  # konwersja na cm
                                     all_parameters['density_values'].append(density_cm)
@@ -306,7 +359,7 @@ class PXFAnalyzer:
                                     
                             # Format 3: Short (dziesiąte mm)
                             if offset + 2 <= len(chunk):
-                                density_s = struct.unpack('<H', chunk[offset:offset+2])[0]
+                                density_s = _UINT16.unpack_from(chunk, offset)[0]
                                 if 1 <= density_s <= 500:
                                     density_cm = density_s / 100.0  # konwersja na cm
                                     all_parameters['density_values'].append(density_cm)
@@ -315,32 +368,11 @@ class PXFAnalyzer:
                             continue
                 
                 # Zaawansowane wykrywanie tekstowe parametrów haftu
-                import re
-                
-                # Wzorce dla różnych parametrów haftu  
-                text_patterns = {
-                    'density': [r'(?:density|gęstość)[:\s=]*(\d+\.?\d*)', 
-                               r'row[_\s]*spacing[:\s=]*(\d+\.?\d*)',
-                               r'pitch[:\s=]*(\d+\.?\d*)'],
-                    'underlay': [r'(?:underlay|podkład)[:\s=]*(\w+)',
-                                r'auto[_\s]*underlay[:\s=]*(\w+)'],
-                    'angle': [r'(?:angle|kąt|direction)[:\s=]*(\d+\.?\d*)',
-                             r'fill[_\s]*angle[:\s=]*(\d+\.?\d*)'],
-                    'stitch_length': [r'(?:stitch[_\s]*length|długość[_\s]*ściegu)[:\s=]*(\d+\.?\d*)',
-                                     r'max[_\s]*stitch[:\s=]*(\d+\.?\d*)'],
-                    'machine_speed': [r'(?:speed|prędkość|velocity)[:\s=]*(\d+)',
-                                     r'machine[_\s]*speed[:\s=]*(\d+)',
-                                     r'rpm[:\s=]*(\d+)'],
-                    'thread_weight': [r'(?:thread[_\s]*weight|waga[_\s]*nici)[:\s=]*(\d+)',
-                                     r'weight[:\s=]*(\d+)wt',
-                                     r'wt[:\s=]*(\d+)']
-                }
-                
                 # Sprawdź wszystkie wzorce tekstowe w różnych kodowaniach
-                for param_type, patterns in text_patterns.items():
+                for param_type, patterns in _TEXT_PATTERNS.items():
                     for pattern in patterns:
                         for text_content in [text_chunk, latin_chunk, ascii_chunk]:
-                            match = re.search(pattern, text_content)
+                            match = pattern.search(text_content)
                             if match:
                                 try:
                                     value = float(match.group(1))
@@ -362,7 +394,7 @@ class PXFAnalyzer:
                         # Wykrywanie parametrów tekstowych (underlay)
                         if param_type == 'underlay':
                             for text_content in [text_chunk, latin_chunk, ascii_chunk]:
-                                match = re.search(patterns[0], text_content)
+                                match = patterns[0].search(text_content)
                                 if match:
                                     underlay_value = match.group(1).strip().lower()
                                     if underlay_value in ['yes', 'true', 'on', 'enabled', 'tak', '1']:
@@ -374,7 +406,7 @@ class PXFAnalyzer:
                 # Parametry podkładu
                 if b'UNDERLAY' in chunk:
                     try:
-                        underlay_type = struct.unpack('<I', self.data[i+8:i+12])[0]
+                        underlay_type = _UINT32.unpack_from(self.data, i+8)[0]
                         underlay_map = {
                             0: 'None',
                             1: 'Edge Run',
@@ -383,7 +415,8 @@ class PXFAnalyzer:
                             4: 'Automatic'
                         }
                         underlay_name = underlay_map.get(underlay_type, 'Unknown')
-                        if underlay_name not in all_parameters['underlay_types']:
+                        if underlay_name not in seen_underlay_types:
+                            seen_underlay_types.add(underlay_name)
                             all_parameters['underlay_types'].append(underlay_name)
                     except struct.error:
                         pass
@@ -391,7 +424,7 @@ class PXFAnalyzer:
                 # Kompensacja
                 if b'COMPENSATION' in chunk or b'PULL' in chunk:
                     try:
-                        compensation = struct.unpack('<f', self.data[i+8:i+12])[0]
+                        compensation = _FLOAT32.unpack_from(self.data, i+8)[0]
                         if -50 <= compensation <= 50:
                             all_parameters['compensation_values'].append(compensation)
                     except struct.error:
@@ -400,7 +433,7 @@ class PXFAnalyzer:
                 # Kąt wypełnienia
                 if b'ANGLE' in chunk or b'FILL_ANGLE' in chunk:
                     try:
-                        angle = struct.unpack('<f', self.data[i+8:i+12])[0]
+                        angle = _FLOAT32.unpack_from(self.data, i+8)[0]
                         if -180 <= angle <= 180:
                             all_parameters['fill_angles'].append(angle)
                     except struct.error:
@@ -409,7 +442,7 @@ class PXFAnalyzer:
                 # Typy ściegów
                 if b'STITCH_TYPE' in chunk or b'FILL_TYPE' in chunk:
                     try:
-                        stitch_type = struct.unpack('<I', self.data[i+8:i+12])[0]
+                        stitch_type = _UINT32.unpack_from(self.data, i+8)[0]
                         stitch_map = {
                             0: 'Running',
                             1: 'Satin',
@@ -419,7 +452,8 @@ class PXFAnalyzer:
                             5: 'Bean Stitch'
                         }
                         stitch_name = stitch_map.get(stitch_type, f'Type {stitch_type}')
-                        if stitch_name not in all_parameters['stitch_types']:
+                        if stitch_name not in seen_stitch_types:
+                            seen_stitch_types.add(stitch_name)
                             all_parameters['stitch_types'].append(stitch_name)
                     except struct.error:
                         pass
@@ -427,7 +461,7 @@ class PXFAnalyzer:
                 # Naprężenie nici
                 if b'TENSION' in chunk:
                     try:
-                        tension = struct.unpack('<f', self.data[i+8:i+12])[0]
+                        tension = _FLOAT32.unpack_from(self.data, i+8)[0]
                         if 0 <= tension <= 100:
                             all_parameters['thread_tensions'].append(tension)
                     except struct.error:
@@ -436,7 +470,7 @@ class PXFAnalyzer:
                 # Dodatkowe parametry długości ściegów
                 if b'STITCH_LENGTH' in chunk or b'LENGTH' in chunk:
                     try:
-                        length = struct.unpack('<f', self.data[i+8:i+12])[0]
+                        length = _FLOAT32.unpack_from(self.data, i+8)[0]
                         if 0.1 <= length <= 10:  # Rozsądne długości ściegów w mm
                             all_parameters['stitch_lengths'].append(length / 10.0)  # Konwersja na cm
                     except struct.error:
@@ -445,7 +479,7 @@ class PXFAnalyzer:
                 # Prędkość maszyny (dodatkowe wykrywanie)
                 if b'SPEED' in chunk or b'MACHINE_SPEED' in chunk:
                     try:
-                        speed = struct.unpack('<I', self.data[i+8:i+12])[0]
+                        speed = _UINT32.unpack_from(self.data, i+8)[0]
                         if 100 <= speed <= 2000:
                             all_parameters['machine_speeds'].append(speed)
                     except struct.error:
@@ -454,7 +488,7 @@ class PXFAnalyzer:
                 # Automatyczny podkład
                 if b'AUTO_UNDERLAY' in chunk or b'AUTOMATIC' in chunk:
                     try:
-                        auto_setting = struct.unpack('<I', self.data[i+8:i+12])[0]
+                        auto_setting = _UINT32.unpack_from(self.data, i+8)[0]
                         if auto_setting in [0, 1]:
                             setting_name = 'Włączony' if auto_setting == 1 else 'Wyłączony'
                             all_parameters['auto_underlay_settings'].append(setting_name)
@@ -467,7 +501,7 @@ class PXFAnalyzer:
                 if any(pattern in chunk for pattern in weight_patterns):
                     for offset in range(0, 64, 4):
                         try:
-                            weight = struct.unpack('<I', self.data[i+offset:i+offset+4])[0]
+                            weight = _UINT32.unpack_from(self.data, i+offset)[0]
                             if 20 <= weight <= 150:
                                 all_parameters['thread_weights'].append(weight)
                                 break
@@ -479,7 +513,7 @@ class PXFAnalyzer:
                 if any(pattern in chunk for pattern in stitch_patterns):
                     for offset in range(0, 64, 4):
                         try:
-                            length = struct.unpack('<f', self.data[i+offset:i+offset+4])[0]
+                            length = _FLOAT32.unpack_from(self.data, i+offset)[0]
                             if 0.05 <= length <= 15:
                                 all_parameters['stitch_lengths'].append(length / 10.0)
                                 break
@@ -488,8 +522,7 @@ class PXFAnalyzer:
                 
                 # Wykrywanie wzorców tekstowych dla różnych parametrów
                 if any(term in text_chunk for term in ['thread', 'weight', 'wt']):
-                    import re
-                    weight_match = re.search(r'(?:weight|wt)[:\s=]*(\d+)', text_chunk)
+                    weight_match = _WEIGHT_PATTERN.search(text_chunk)
                     if weight_match:
                         try:
                             weight_val = int(weight_match.group(1))
@@ -503,7 +536,7 @@ class PXFAnalyzer:
                 if any(pattern in chunk for pattern in speed_patterns):
                     for offset in range(0, 64, 4):
                         try:
-                            speed = struct.unpack('<I', self.data[i+offset:i+offset+4])[0]
+                            speed = _UINT32.unpack_from(self.data, i+offset)[0]
                             if 50 <= speed <= 3000:
                                 all_parameters['machine_speeds'].append(speed)
                                 all_parameters['embroidery_speeds'].append(speed)
@@ -513,7 +546,7 @@ class PXFAnalyzer:
                 
                 if b'NEEDLE_SIZE' in chunk or b'NEEDLE' in chunk:
                     try:
-                        needle = struct.unpack('<I', self.data[i+8:i+12])[0]
+                        needle = _UINT32.unpack_from(self.data, i+8)[0]
                         if 60 <= needle <= 120:  # Typowe rozmiary igieł
                             all_parameters['needle_sizes'].append(needle)
                     except struct.error:
@@ -521,7 +554,7 @@ class PXFAnalyzer:
                 
                 if b'FABRIC_TYPE' in chunk or b'FABRIC' in chunk:
                     try:
-                        fabric_code = struct.unpack('<I', self.data[i+8:i+12])[0]
+                        fabric_code = _UINT32.unpack_from(self.data, i+8)[0]
                         fabric_types = {
                             1: 'Cotton', 2: 'Polyester', 3: 'Silk', 4: 'Denim',
                             5: 'Leather', 6: 'Canvas', 7: 'Fleece', 8: 'Terry'
@@ -533,7 +566,7 @@ class PXFAnalyzer:
                 
                 if b'HOOP_SIZE' in chunk or b'HOOP' in chunk:
                     try:
-                        hoop = struct.unpack('<f', self.data[i+8:i+12])[0]
+                        hoop = _FLOAT32.unpack_from(self.data, i+8)[0]
                         if 50 <= hoop <= 400:  # mm
                             all_parameters['hoop_sizes'].append(hoop / 10.0)  # Konwersja na cm
                     except struct.error:
@@ -541,7 +574,7 @@ class PXFAnalyzer:
                 
                 if b'STABILIZER' in chunk:
                     try:
-                        stab_type = struct.unpack('<I', self.data[i+8:i+12])[0]
+                        stab_type = _UINT32.unpack_from(self.data, i+8)[0]
                         stabilizers = {
                             0: 'None', 1: 'Tear-away', 2: 'Cut-away', 
                             3: 'Wash-away', 4: 'Heat-away', 5: 'Sticky'
@@ -662,6 +695,8 @@ class PXFAnalyzer:
             if varied_params > 0:
                 params['multi_pattern_note'] = f"Znaleziono {varied_params} parametrów z różnymi wartościami - prawdopodobnie wiele wzorów"
         
+        except TimeoutError:
+            raise
         except Exception as e:
             params['error'] = f'Błąd wyciągania parametrów: {e}'
         
@@ -676,7 +711,7 @@ class PXFAnalyzer:
         analysis['first_bytes'] = self.data[:32].hex()
         
         # Szukamy wzorców tekstowych
-        text_content = self.data.decode('utf-8', errors='ignore')
+        text_content = self._get_text_content()
         
         # Informacje o oprogramowaniu
         software_patterns = [
@@ -699,7 +734,7 @@ class PXFAnalyzer:
         params = {}
         
         # Analiza tekstu
-        text_content = self.data.decode('utf-8', errors='ignore')
+        text_content = self._get_text_content()
         
         # Wzorce do wyszukania
         patterns = {
@@ -725,20 +760,17 @@ class PXFAnalyzer:
         patterns = []
         
         # Analizujemy większy zakres danych
+        # (zakres pętli gwarantuje 6 bajtów rekordu - bez try/except)
         for i in range(0, len(self.data) - 6, 1):  # Co 1 bajt zamiast co 2
-            try:
-                x = struct.unpack('<h', self.data[i:i+2])[0]
-                y = struct.unpack('<h', self.data[i+2:i+4])[0]
-                cmd = struct.unpack('<H', self.data[i+4:i+6])[0]
+            if not i & 0xFFFF:
+                self._check_deadline()
+            x, y, cmd = _STITCH_XYC.unpack_from(self.data, i)
+            
+            if -32000 < x < 32000 and -32000 < y < 32000:
+                coordinates.append((x, y, cmd))
                 
-                if -32000 < x < 32000 and -32000 < y < 32000:
-                    coordinates.append((x, y, cmd))
-                    
-                    if len(coordinates) >= 30000:  # Maksymalny limit dla ultra-szczegółowej analizy
-                        break
-                        
-            except struct.error:
-                continue
+                if len(coordinates) >= 30000:  # Maksymalny limit dla ultra-szczegółowej analizy
+                    break
         
         if coordinates:
             stitch_data['coordinate_count'] = len(coordinates)
@@ -819,7 +851,7 @@ class PXFAnalyzer:
             
             # Sprawdź czy punkt należy do aktualnego wzoru czy zaczyna nowy
             recent_points = current_pattern[-20:]  # Ostatnie 20 punktów
-            distances = [((x - px)**2 + (y - py)**2)**0.5 for px, py, _ in recent_points]
+            distances = [math.hypot(x - px, y - py) for px, py, _ in recent_points]
             min_distance = min(distances) if distances else float('inf')
             
             # Jeśli punkt jest daleko od ostatnich punktów w wzorze
@@ -854,8 +886,8 @@ class PXFAnalyzer:
                 prev_x, prev_y, _ = coordinates[i-1]
                 next_x, next_y, _ = coordinates[i+1] if i+1 < len(coordinates) else (x, y, 0)
                 
-                jump_to_current = ((x - prev_x)**2 + (y - prev_y)**2)**0.5
-                jump_from_current = ((next_x - x)**2 + (next_y - y)**2)**0.5
+                jump_to_current = math.hypot(x - prev_x, y - prev_y)
+                jump_from_current = math.hypot(next_x - x, next_y - y)
                 
                 # Duży skok in + duży skok out = prawdopodobnie koniec wzoru
                 if (jump_to_current > 5000 and jump_from_current > 3000 and 
@@ -891,7 +923,7 @@ class PXFAnalyzer:
                 if j > 0:
                     curr_x, curr_y, _ = coordinates[j]
                     prev_x, prev_y, _ = coordinates[j-1]
-                    jump_distance = ((curr_x - prev_x)**2 + (curr_y - prev_y)**2)**0.5
+                    jump_distance = math.hypot(curr_x - prev_x, curr_y - prev_y)
                     
                     # Koniec wzoru: spadek gęstości + duży skok
                     if (next_density < current_density * 0.5 and 
@@ -934,7 +966,7 @@ class PXFAnalyzer:
         
         try:
             # Szukaj informacji o oprogramowaniu
-            text_content = self.data.decode('utf-8', errors='ignore')
+            text_content = self._get_text_content()
             
             # Wzorce oprogramowania
             software_patterns = {
@@ -948,7 +980,6 @@ class PXFAnalyzer:
                 'janome': r'(?i)janome'
             }
             
-            import re
             for software, pattern in software_patterns.items():
                 if re.search(pattern, text_content):
                     metadata['detected_software'] = software.title()
@@ -1013,7 +1044,7 @@ class PXFAnalyzer:
             ]
             
             for marker, description in section_markers:
-                if marker in self.data:
+                if self.data.find(marker) != -1:
                     sections.append(description)
             
             if sections:
@@ -1045,17 +1076,12 @@ class PXFAnalyzer:
             if hasattr(self, 'coordinate_count') and self.coordinate_count:
                 stitch_count = self.coordinate_count
             else:
-                # Spróbuj policzyć ściegi
-                coordinates = []
-                for i in range(0, min(len(self.data) - 6, 30000), 6):
-                    try:
-                        x = struct.unpack('<h', self.data[i:i+2])[0]
-                        y = struct.unpack('<h', self.data[i+2:i+4])[0]
-                        if -32000 < x < 32000 and -32000 < y < 32000:
-                            coordinates.append((x, y))
-                    except:
-                        continue
-                stitch_count = len(coordinates)
+                # Spróbuj policzyć ściegi (rekordy 6-bajtowe, x i y na początku)
+                record_count = max(0, (min(len(self.data) - 6, 30000) + 5) // 6)
+                stitch_count = sum(
+                    1 for x, y in _STITCH_RECORD_XY.iter_unpack(
+                        self.data[:record_count * 6])
+                    if -32000 < x < 32000 and -32000 < y < 32000)
             
             if stitch_count > 0:
                 # Szacunki czasowe (na podstawie standardowych prędkości haftu)
@@ -1160,7 +1186,7 @@ class PXFAnalyzer:
             
             # Oblicz dystans od poprzedniego punktu
             prev_x, prev_y, _ = coordinates[i-1]
-            distance = ((x - prev_x)**2 + (y - prev_y)**2)**0.5
+            distance = math.hypot(x - prev_x, y - prev_y)
             
             # Jeśli dystans > 5cm (500 jednostek), prawdopodobnie nowy wzór
             if distance > 500 and len(current_pattern) > 10:
@@ -1223,7 +1249,7 @@ class PXFAnalyzer:
             # Sprawdź średnią odległość od punktów w aktualnym wzorze
             distances = []
             for px, py, _ in current_pattern[-5:]:  # Ostatnie 5 punktów dla większej czułości
-                dist = ((x - px)**2 + (y - py)**2)**0.5
+                dist = math.hypot(x - px, y - py)
                 distances.append(dist)
             
             avg_distance = sum(distances) / len(distances) if distances else 0
@@ -1266,15 +1292,13 @@ class PXFAnalyzer:
         }
         
         # Średnia długość ściegu (analizuj maksymalną ilość punktów)
-        distances = []
-        for i in range(1, min(len(coordinates), 3000)):
-            x1, y1, _ = coordinates[i-1]
-            x2, y2, _ = coordinates[i]
-            dist = ((x2-x1)**2 + (y2-y1)**2)**0.5
-            distances.append(dist)
-        
-        if distances:
-            pattern_info['average_stitch_length'] = sum(distances) / len(distances) / 100.0  # w cm
+        # (suma liczona w locie, bez budowania listy odległości)
+        sample = coordinates[:3000]
+        if len(sample) > 1:
+            total_distance = sum(
+                math.hypot(x2 - x1, y2 - y1)
+                for (x1, y1, _), (x2, y2, _) in zip(sample, sample[1:]))
+            pattern_info['average_stitch_length'] = total_distance / (len(sample) - 1) / 100.0  # w cm
         
         # Analiza typu ściegów na podstawie komend
         stitch_types = self._analyze_pattern_stitch_types(coordinates)
@@ -1306,23 +1330,13 @@ class PXFAnalyzer:
         if not coordinates:
             return {}
         
-        command_counts = {}
-        jump_commands = 0
-        stitch_commands = 0
-        special_commands = 0
+        command_counts = Counter(cmd for _, _, cmd in coordinates)
         
-        for x, y, cmd in coordinates:
-            if cmd not in command_counts:
-                command_counts[cmd] = 0
-            command_counts[cmd] += 1
-            
-            # Kategoryzacja komend
-            if cmd == 0x0000:  # Normalny ścieg
-                stitch_commands += 1
-            elif cmd in [0x0001, 0x0002, 0x0003]:  # Przeskok
-                jump_commands += 1
-            elif cmd >= 0x8000:  # Specjalne komendy
-                special_commands += 1
+        # Kategoryzacja komend
+        stitch_commands = command_counts[0x0000]  # Normalny ścieg
+        jump_commands = sum(command_counts[cmd] for cmd in (0x0001, 0x0002, 0x0003))  # Przeskok
+        special_commands = sum(count for cmd, count in command_counts.items()
+                               if cmd >= 0x8000)  # Specjalne komendy
         
         # Interpretacja typów ściegów
         stitch_types = []
@@ -1397,7 +1411,7 @@ class PXFAnalyzer:
             if pos != -1 and pos + 8 < len(self.data):
                 try:
                     # Próbujemy wyciągnąć wartość numeryczną
-                    value = struct.unpack('<I', self.data[pos+4:pos+8])[0]
+                    value = _UINT32.unpack_from(self.data, pos+4)[0]
                     
                     if marker == b'SPEED' and 100 <= value <= 2000:
                         settings['machine_speed'] = f"{value} spm"
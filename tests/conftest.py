@@ -0,0 +1,57 @@
+"""Wspólne fixtures testów: deterministyczny przykładowy plik PMLPXF"""
+import random
+import struct
+
+import pytest
+
+
+def build_sample_pxf(coordinate_count=1500):
+    """Build a small PMLPXF01 file with metadata, colour and stitch sections"""
+    rng = random.Random(7)
+    data = bytearray(b'PMLPXF01')
+    data += struct.pack('<4I', 64, 5000, 123450, 98760)
+    data += struct.pack('<4I', 300, 250, 10, 20)
+    data += struct.pack('<3I', 3, 4200, 0x05)
+    data += b'\x00' * (64 - len(data))
+    data += b'  Created with Tajima DG16 by Pulse 2019-05-12 name: Rose Design  '
+    data += b'DENSITY\x00' + struct.pack('<If', 450, 0.4) + b'\x00' * 8
+    data += b'UNDERLAY ZIGZAG\x00' + struct.pack('<I', 2)
+    data += b'PULL\x00\x00\x00\x00' + struct.pack('<H', 35) + b'\x00' * 6
+    data += b'FILL SATIN TATAMI\x00'
+    data += b'SPEED\x00\x00\x00' + struct.pack('<H', 800) + b'\x00' * 6
+    data += b'TENSION\x00' + struct.pack('<H', 12) + b'\x00' * 6
+    data += b'HOOP 130x180 \x00TAJIMA machine\x00TRIM AUTO\x00'
+    data += (b'<density>0.45</density><angle>45</angle> density=0.42 '
+             b'angle=30 stitch_length=3.5 ')
+    data += b'CLRS' + struct.pack('<4I', 3, 0xFF0000, 0x00FF00, 0x2020F0)
+    data += b'STCH' + struct.pack('<I', coordinate_count)
+    x = y = 0
+    for i in range(coordinate_count):
+        if i % 300 == 299:
+            # Co 300 ściegów skok do kolejnego obiektu
+            x += rng.randint(3000, 6000)
+            y += rng.randint(-500, 500)
+            command = 0x8003
+        else:
+            x += rng.randint(-40, 40)
+            y += rng.randint(-40, 40)
+            command = 0
+        data += struct.pack('<hhH', x, y, command)
+    data += b'OUTLINE STEM BEAN\x00 satin tatami outline'
+    return bytes(data)
+
+
+@pytest.fixture
+def sample_pxf(tmp_path):
+    """Path of a freshly written sample PXF file"""
+    path = tmp_path / 'sample.pxf'
+    path.write_bytes(build_sample_pxf())
+    return path
+
+
+@pytest.fixture(autouse=True)
+def upload_folder(tmp_path, monkeypatch):
+    """Keep job files and the PXF disk cache out of the shared temp dir"""
+    import app
+    monkeypatch.setitem(app.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    return tmp_path
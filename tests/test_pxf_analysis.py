@@ -0,0 +1,179 @@
+import mmap
+import os
+import stat
+import struct
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import app
+
+
+def test_rgb_triples_step_three_bytes():
+    # Trójki od offsetów 0, 3, 6 - bez okien nachodzących na siebie
+    buf = np.frombuffer(b'PMLPXF01' + bytes(range(100, 130)), dtype=np.uint8)
+    triples = app.find_rgb_triples(buf)
+    assert triples[:3] == [(0x50, 0x4D, 0x4C), (0x50, 0x58, 0x46),
+                           (0x30, 0x31, 100)]
+    assert (0x4D, 0x4C, 0x50) not in triples
+
+
+def test_rgb_triples_skip_dark_and_duplicates():
+    buf = np.frombuffer(bytes([10, 10, 10, 200, 0, 0, 200, 0, 0, 0, 0, 90]) +
+                        b'\x00' * 6, dtype=np.uint8)
+    assert app.find_rgb_triples(buf) == [(200, 0, 0), (0, 0, 90)]
+
+
+def test_pxf_colours_without_colour_section(tmp_path):
+    # Bez sekcji CLRS kolory pochodzą ze skanu trójek od początku pliku
+    path = tmp_path / 'no_colours.pxf'
+    path.write_bytes(b'PMLPXF01' +
+                     struct.pack('<9I', 64, 5000, 1000, 900, 300, 250, 0,
+                                 10, 0) + bytes(range(60, 160)) * 5)
+    analysis = app.try_pxf_analysis(str(path))
+    hexes = [color['hex'] for color in analysis['colors']]
+    assert hexes[:2] == ['#504D4C', '#505846']
+    assert '#4D4C50' not in hexes
+
+
+def test_raw_data_analysis_is_bounded(sample_pxf):
+    # Prawie każdy offset to "trafienie" sondy float - wynik musi być ograniczony
+    analysis = app.try_pxf_analysis(str(sample_pxf))
+    raw_analysis = (analysis['embroidery_parameters']['alternative_analysis']
+                    ['raw_data_analysis'])
+    assert len(raw_analysis) == app.PXF_FLOAT_PROBE_MAX_HITS
+    offsets = [int(key.rsplit('_', 1)[1]) for key in raw_analysis]
+    assert offsets == sorted(offsets)
+
+
+def test_float_probe_stops_across_blocks():
+    # Pierwszy blok bez trafień (NaN), trafienia dopiero w drugim bloku
+    data = b'\xff' * (64 * 1024) + struct.pack('<f', 2.5) * 40000
+    results = app.analyze_pxf_with_alternative_methods(data, '')
+    raw_analysis = results['raw_data_analysis']
+    assert len(raw_analysis) == app.PXF_FLOAT_PROBE_MAX_HITS
+    assert raw_analysis['potential_density_65536'] == '2.50'
+
+
+def test_pxf_helper_fields(sample_pxf):
+    # Pola z pomocniczych analiz PXF (wcześniej gubione przez NameError
+    # z brakujących importów struct/re)
+    analysis = app.try_pxf_analysis(str(sample_pxf))
+
+    params = analysis['embroidery_parameters']
+    assert params['fill_angle'] == '0°'
+    assert params['row_spacing'] == '0.04 cm'
+    assert (params['alternative_analysis']['parameters_found']['header_size']
+            == '64 bytes')
+
+    techniques = analysis['stitch_techniques']
+    assert set(techniques['fill_techniques']) == {
+        'Cross Hatch', 'Tatami Fill', 'Variable Density Fill'}
+    assert set(techniques['outline_techniques']) == {'Stem Stitch',
+                                                     'Outline Stitch'}
+
+    machine = analysis['machine_settings']
+    assert machine['machine_speed'] == '800 ściegów/min'
+    assert machine['thread_tension'] == 'Poziom 12'
+    assert machine['hoop_dimensions'] == '13.0x18.0 cm'
+    assert machine['machine_type'] == 'Tajima'
+    assert machine['jump_settings'] == {
+        'average_jump': '62.40 cm',
+        'max_jump': '130.79 cm',
+        'jump_count': 1101
+    }
+
+
+def test_pxf_cache_uses_given_content_key(sample_pxf):
+    analysis = app.try_pxf_analysis(str(sample_pxf), content_key='0' * 32)
+    assert os.path.exists(app.pxf_cache_path('0' * 32))
+    assert app.try_pxf_analysis(str(sample_pxf),
+                                content_key='0' * 32) == analysis
+
+
+def test_pxf_cache_is_pruned(monkeypatch):
+    def cached_keys():
+        return sorted(name[len('.pxfcache_'):-len('.json')]
+                      for name in os.listdir(app.pxf_cache_dir()))
+
+    now = time.time()
+    for age, key in ((10, 'a'), (20, 'b'), (30, 'c')):
+        app.store_pxf_cache(key, {'colors': []})
+        os.utime(app.pxf_cache_path(key), (now - age, now - age))
+
+    # Limit liczby wpisów - zostają najnowsze
+    monkeypatch.setattr(app, 'PXF_DISK_CACHE_MAX_ENTRIES', 2)
+    app.store_pxf_cache('d', {'colors': []})
+    assert cached_keys() == ['a', 'd']
+
+    # Przeterminowane wpisy nie są zwracane i znikają przy kolejnym zapisie
+    monkeypatch.setattr(app, 'PXF_DISK_CACHE_MAX_ENTRIES', 10)
+    expired = now - app.PXF_DISK_CACHE_TTL - 1
+    os.utime(app.pxf_cache_path('a'), (expired, expired))
+    assert app.load_pxf_cache('a') is None
+    app.store_pxf_cache('e', {'colors': []})
+    assert cached_keys() == ['d', 'e']
+
+
+def test_analysis_timeout_outside_main_thread(sample_pxf, monkeypatch):
+    # Limit czasu musi działać także w wątkach żądań (gthread)
+    monkeypatch.setattr(app, 'PXF_ANALYSIS_TIMEOUT', -1)
+    results = []
+    worker = threading.Thread(target=lambda: results.append(
+        app.analyze_embroidery_file(str(sample_pxf), file_ext='.pxf')))
+    worker.start()
+    worker.join()
+
+    analysis, error = results[0]
+    assert analysis is None
+    assert 'timed out' in error
+
+
+def test_stitch_techniques_overlapping_markers():
+    techniques = app.extract_pxf_stitch_techniques(b'CROSSATIN CROSSTEM')
+    # Markery nachodzące na siebie są wykrywane niezależnie
+    assert set(techniques['outline_techniques']) == {'Stem Stitch'}
+    assert set(techniques['special_effects']) == {'Cross Hatch',
+                                                  'Satin Stitch'}
+
+
+@pytest.mark.parametrize('timeout', [app.PXF_ANALYSIS_TIMEOUT, -1])
+def test_pxf_mapping_is_closed(sample_pxf, monkeypatch, caplog, timeout):
+    mappings = []
+
+    class TrackingMmap(mmap.mmap):
+        def __init__(self, *args, **kwargs):
+            mappings.append(self)
+
+    monkeypatch.setattr(mmap, 'mmap', TrackingMmap)
+    monkeypatch.setattr(app, 'PXF_ANALYSIS_TIMEOUT', timeout)
+    try:
+        app.try_pxf_analysis(str(sample_pxf))
+    except TimeoutError:
+        pass
+
+    assert len(mappings) == 1 and mappings[0].closed
+    assert 'still in use' not in caplog.text
+
+
+def test_row_spacing_from_spacing_marker():
+    # Znacznik "Spacing" bez "density" - wartość float tuż przed nim
+    data = b'\x00' * 40 + struct.pack('<f', 4.5) + b'Spacing' + b'\x00' * 40
+    params = app.extract_pxf_embroidery_parameters(data, '')
+    assert params['row_spacing'] == '0.45 cm'
+
+
+def test_pxf_cache_directory_is_private(upload_folder):
+    cache_dir = app.pxf_cache_dir()
+    assert os.path.dirname(cache_dir) == str(upload_folder)
+    assert stat.S_IMODE(os.stat(cache_dir).st_mode) == 0o700
+
+    # Katalog dostępny dla innych użytkowników - cache wyłączony
+    app.store_pxf_cache('a', {'colors': []})
+    os.chmod(cache_dir, 0o777)
+    assert app.pxf_cache_dir() is None
+    assert app.load_pxf_cache('a') is None
+    app.store_pxf_cache('b', {'colors': []})
+    assert os.listdir(cache_dir) == ['.pxfcache_a.json']
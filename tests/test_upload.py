@@ -0,0 +1,92 @@
+import io
+import os
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    app.app.config['TESTING'] = True
+    app.app.secret_key = 'test'
+    app._analysis_cache.clear()
+    yield app.app.test_client()
+    app._analysis_cache.clear()
+
+
+def upload(client, data, name='design.dst'):
+    return client.post('/upload',
+                       data={'file': (io.BytesIO(data), name)},
+                       content_type='multipart/form-data')
+
+
+def test_failed_analysis_is_not_cached(client, monkeypatch):
+    calls = []
+
+    def fake_analyze(file_path, **kwargs):
+        calls.append(file_path)
+        if len(calls) == 1:
+            return None, 'Analysis timed out'
+        return {'filename': 'design.dst', 'colors': []}, None
+
+    monkeypatch.setattr(app, 'analyze_embroidery_file', fake_analyze)
+    monkeypatch.setattr(app, 'render_analysis',
+                        lambda analysis, error, filename: error or 'ok')
+
+    assert upload(client, b'same content').data == b'Analysis timed out'
+    assert upload(client, b'same content').data == b'ok'
+    # Udany wynik jest już w cache
+    assert upload(client, b'same content').data == b'ok'
+    assert len(calls) == 2
+
+
+def test_oversized_upload_is_rejected(client, monkeypatch):
+    # Limit egzekwuje Flask (MAX_CONTENT_LENGTH) przed parsowaniem formularza
+    monkeypatch.setitem(app.app.config, 'MAX_CONTENT_LENGTH', 1024)
+    monkeypatch.setattr(app, 'analyze_embroidery_file',
+                        lambda *args, **kwargs: pytest.fail('analyzed'))
+
+    response = upload(client, b'x' * 4096)
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert 'File is too large' in session['_flashes'][0][1]
+
+
+def test_background_submit_failure_cleans_up(client, monkeypatch,
+                                             upload_folder):
+    def broken_pool(*args):
+        raise RuntimeError('pool unavailable')
+
+    monkeypatch.setattr(app, 'BACKGROUND_ANALYSIS_MIN_SIZE', 1)
+    monkeypatch.setattr(app, 'submit_background_analysis', broken_pool)
+
+    response = upload(client, b'large design')
+    assert response.status_code == 302
+    # Ani plik tymczasowy, ani stan zadania nie zostają na dysku
+    assert list(upload_folder.iterdir()) == []
+
+
+def test_stale_pending_job_expires(client, upload_folder):
+    temp_path = upload_folder / 'upload.pxf'
+    temp_path.write_bytes(b'PMLPXF01')
+    fresh_id, stale_id = 'a' * 32, 'b' * 32
+    for job_id, age in ((fresh_id, 0),
+                        (stale_id, app.BACKGROUND_JOB_TIMEOUT + 1)):
+        app.write_job_state(job_id, {
+            'status': 'pending',
+            'filename': 'design.pxf',
+            'temp_path': str(temp_path),
+            'submitted_at': time.time() - age
+        })
+
+    response = client.get(f'/result/{fresh_id}')
+    assert response.status_code == 200
+    assert b'Analiza w toku' in response.data
+
+    response = client.get(f'/result/{stale_id}')
+    assert response.status_code == 302
+    assert not os.path.exists(app.job_result_path(stale_id))
+    assert not temp_path.exists()
+    assert os.path.exists(app.job_result_path(fresh_id))